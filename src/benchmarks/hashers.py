@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import time
+
+import django
+
+
+def rate(function, seconds):
+    # Calls per second of `function` on one thread, which is one core for
+    # the hashers: logins/s per core for a verify, signups/s for an encode.
+    calls = 0
+    started_at = time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - started_at
+        if elapsed >= seconds:
+            return calls / elapsed
+
+
+def variants():
+    # The configured hashers plus a few other work factors to compare with.
+    from django.conf import settings
+
+    variants = {
+        'pbkdf2': ({}, 'pbkdf2_sha256'),
+        'argon2': ({}, 'argon2'),
+        'transitional': ({}, 'pbkdf2_transitional'),
+    }
+    for iterations in (100_000, 320_000, 600_000):
+        if iterations != settings.PASSWORD_PBKDF2_ITERATIONS:
+            variants[f'pbkdf2_{iterations}'] = ({'PASSWORD_PBKDF2_ITERATIONS': iterations}, 'pbkdf2_sha256')
+    if settings.PASSWORD_ARGON2_PARALLELISM != 8:
+        # Django's default parallelism.
+        variants['argon2_p8'] = ({'PASSWORD_ARGON2_PARALLELISM': 8}, 'argon2')
+    return variants
+
+
+def run(seconds=2.0):
+    # signups_per_second times an encode and logins_per_second a successful
+    # check_password. With PASSWORD_SIGNUP_DEFERRED_HASHING the signup request
+    # only pays the transitional encode, the worker pays `wrap`.
+    from django.contrib.auth.hashers import check_password, get_hasher, make_password
+    from django.test import override_settings
+
+    from restapi.hashers import wrap
+
+    report = {}
+    for name, (overrides, algorithm) in variants().items():
+        with override_settings(**overrides):
+            hasher = get_hasher(algorithm)
+            if getattr(hasher, 'library', None):
+                try:
+                    hasher._load_library()
+                except ValueError as exc:
+                    report[name] = {'error': str(exc)}
+                    continue
+            encoded = make_password('benchmark-password', hasher=algorithm)
+            report[name] = {
+                'algorithm': algorithm,
+                'params': {key: value for key, value in hasher.safe_summary(encoded).items() if key not in ('salt', 'hash')},
+                'signups_per_second': rate(lambda: make_password('benchmark-password', hasher=algorithm), seconds),
+                'logins_per_second': rate(lambda: check_password('benchmark-password', encoded), seconds),
+            }
+    transitional = make_password('benchmark-password', hasher='pbkdf2_transitional')
+    wrapped = wrap(transitional)
+    report['wrapped'] = {
+        'algorithm': 'wrapped',
+        'wraps_per_second': rate(lambda: wrap(transitional), seconds),
+        'logins_per_second': rate(lambda: check_password('benchmark-password', wrapped), seconds),
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures signups/s and logins/s per core for each password hasher setup.')
+    parser.add_argument('--seconds', type=float, default=2.0, help='Time spent on each measurement.')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'saas.settings')
+    django.setup()
+    print(json.dumps(run(args.seconds), indent=2, default=str))
+
+
+if __name__ == '__main__':
+    main()
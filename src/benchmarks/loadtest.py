@@ -0,0 +1,136 @@
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import requests
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def summarize(samples, elapsed):
+    latencies = [latency for latency, _ in samples]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, status in samples if status >= 400),
+        'requests_per_second': len(samples) / elapsed if elapsed else 0,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+    }
+
+
+def setup_fixtures(base_url, members):
+    # Creates a user with a token, a company and `members` extra members
+    # through the public API, and returns the token and the paths to load.
+    session = requests.Session()
+    suffix = uuid.uuid4().hex[:10]
+    password = uuid.uuid4().hex
+    email = f'loadtest-{suffix}@example.com'
+    response = session.post(f'{base_url}/api/user/', json={
+        'first_name': 'load', 'last_name': 'test', 'email': email, 'password': password
+    })
+    response.raise_for_status()
+    user_id = response.json()['id']
+    login = session.post(f'{base_url}/api/login/', json={'username': email, 'password': password})
+    login.raise_for_status()
+    token = login.json()['token']
+    headers = {'Authorization': f'Token {token}'}
+    cnpj = ''.join(random.choice('0123456789') for _ in range(14))
+    company = session.post(f'{base_url}/api/company/', json={
+        'corporate_name': f'loadtest {suffix}', 'trade_name': 'loadtest', 'cnpj': cnpj, 'user': [user_id]
+    })
+    company.raise_for_status()
+    company_id = company.json()['id']
+    for index in range(members):
+        member = session.post(f'{base_url}/api/user/', json={
+            'first_name': 'member', 'last_name': str(index),
+            'email': f'loadtest-{suffix}-{index}@example.com', 'password': password
+        })
+        member.raise_for_status()
+        registry = session.post(
+            f'{base_url}/api/company/members/registry/',
+            json={'company_id': company_id, 'user_id': member.json()['id']},
+            headers=headers,
+        )
+        registry.raise_for_status()
+    return token, ['/api/user/companies/', f'/api/company/{company_id}/members/']
+
+
+def run(base_url, paths, token, concurrency, duration):
+    headers = {'Authorization': f'Token {token}'} if token else {}
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(offset):
+        session = requests.Session()
+        local = defaultdict(list)
+        index = offset
+        while time.monotonic() < deadline:
+            path = paths[index % len(paths)]
+            index += 1
+            started_at = time.perf_counter()
+            try:
+                status = session.get(f'{base_url}{path}', headers=headers).status_code
+            except requests.RequestException:
+                status = 599
+            local[path].append(((time.perf_counter() - started_at) * 1000, status))
+        with lock:
+            for path, values in local.items():
+                samples[path].extend(values)
+
+    started_at = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started_at
+
+    return {
+        'concurrency': concurrency,
+        'duration_seconds': elapsed,
+        'total': summarize([sample for values in samples.values() for sample in values], elapsed),
+        'paths': {path: summarize(values, elapsed) for path, values in samples.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures requests/s and latency percentiles of the /api/ endpoints.')
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--token', help='Existing API token; a user and company are created when omitted.')
+    parser.add_argument('--path', action='append', dest='paths', help='Path to request, may be repeated.')
+    parser.add_argument('--members', type=int, default=20, help='Members added to the fixture company.')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--output', help='Writes the JSON report to this file as well.')
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip('/')
+    token, paths = args.token, args.paths
+    if not token:
+        token, default_paths = setup_fixtures(base_url, args.members)
+        paths = paths or default_paths
+    if not paths:
+        parser.error('--path is required together with --token')
+
+    report = run(base_url, paths, token, args.concurrency, args.duration)
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as stream:
+            stream.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import random
+import time
+
+import django
+
+
+def timed(function, repeat):
+    # Best of `repeat` runs, in seconds.
+    best = None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started_at
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def paths():
+    # The list actions before and after the values() serializers: each path
+    # maps to (load rows, serialize and render the loaded rows).
+    from django.db.models import Prefetch
+    from rest_framework.renderers import JSONRenderer
+
+    from restapi.models import Company, User
+    from restapi.renderers import ORJSONRenderer
+    from restapi.serializers import CompanySerializer, CompanyValuesSerializer, UserSerializer, UserValuesSerializer
+
+    def model(queryset, serializer_class):
+        return (
+            lambda rows: list(queryset[:rows]),
+            lambda loaded: JSONRenderer().render(serializer_class(loaded, many=True).data),
+        )
+
+    def values(queryset, serializer_class):
+        return (
+            lambda rows: list(serializer_class.values(queryset)[:rows]),
+            lambda loaded: ORJSONRenderer().render(serializer_class(loaded).data),
+        )
+
+    companies = Company.objects.order_by('id')
+    users = User.objects.order_by('id')
+    return {
+        'companies': {
+            'model_serializer': model(
+                companies.only('id', 'corporate_name', 'trade_name', 'cnpj')
+                .prefetch_related(Prefetch('user', queryset=User.objects.only('id'))),
+                CompanySerializer,
+            ),
+            'values_serializer': values(companies, CompanyValuesSerializer),
+        },
+        'users': {
+            'model_serializer': model(users.only('id', 'first_name', 'last_name', 'email'), UserSerializer),
+            'values_serializer': values(users, UserValuesSerializer),
+        },
+    }
+
+
+def run(rows, repeat=5):
+    # `encode` times serialization and rendering of rows already loaded (the
+    # values path still reads the many-to-many ids there), `total` includes
+    # loading them.
+    report = {}
+    for name, variants in paths().items():
+        results = {}
+        for variant, (load, encode) in variants.items():
+            loaded = load(rows)
+            encode_seconds = timed(lambda: encode(loaded), repeat)
+            total_seconds = timed(lambda: encode(load(rows)), repeat)
+            results[variant] = {
+                'rows': len(loaded),
+                'encode_rows_per_second': len(loaded) / encode_seconds if encode_seconds else 0,
+                'total_rows_per_second': len(loaded) / total_seconds if total_seconds else 0,
+            }
+        baseline, current = results['model_serializer'], results['values_serializer']
+        results['speedup'] = {
+            metric: current[metric] / baseline[metric] if baseline[metric] else None
+            for metric in ('encode_rows_per_second', 'total_rows_per_second')
+        }
+        report[name] = results
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the ModelSerializer and values() serializer paths of the list actions.')
+    parser.add_argument('--rows', type=int, default=10_000, help='Rows serialized per run.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'saas.settings')
+    django.setup()
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    from benchmarks.suite import USERS_PER_COMPANY, seed
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        seed(args.rows * USERS_PER_COMPANY, random.Random(args.seed), stale=0)
+        report = run(args.rows, repeat=args.repeat)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubCNPJServer:
+    # Local stand-in for receitaws, used by the tests and the benchmark suite:
+    # serves `companies[cnpj]` as JSON and `{'status': 'ERROR'}` for unknown
+    # CNPJs. `failures[cnpj]` lists status codes to answer before the real
+    # payload, to exercise retries.
+
+    def __init__(self, companies=None, failures=None):
+        self.companies = companies or {}
+        self.failures = failures or {}
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; with Nagle on, keep-alive
+            # clients would wait for a delayed ACK on every response.
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                cnpj = self.path.rstrip('/').rsplit('/', 1)[-1]
+                stub.requests.append(cnpj)
+                pending = stub.failures.get(cnpj)
+                if pending:
+                    status, payload = pending.pop(0), {'status': 'ERROR'}
+                else:
+                    status, payload = 200, stub.companies.get(cnpj, {'status': 'ERROR'})
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/v1/'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def company_payload(nome, fantasia='', situacao='ATIVA'):
+    return {'status': 'OK', 'nome': nome, 'fantasia': fantasia, 'situacao': situacao}
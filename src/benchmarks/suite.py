@@ -0,0 +1,354 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import timedelta
+
+import django
+
+from benchmarks.loadtest import percentile
+
+
+SCALES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+PASSWORD = 'benchmark'
+USERS_PER_COMPANY = 10
+HOT_COMPANY_MEMBERS = 2_000
+USER_COMPANIES = 50
+# company-list shares its path with company-create, which is listed first in
+# restapi.urls and therefore serves every request to it.
+SHADOWED_ROUTES = {'company-list'}
+
+
+def parse_scale(value):
+    value = value.lower()
+    if value in SCALES:
+        return SCALES[value]
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'scale must be one of {", ".join(SCALES)} or a number of users')
+
+
+def route_names():
+    from restapi.urls import api_urls
+
+    def walk(patterns):
+        for pattern in patterns:
+            if hasattr(pattern, 'url_patterns'):
+                yield from walk(pattern.url_patterns)
+            elif pattern.name:
+                yield pattern.name
+
+    return set(walk(api_urls))
+
+
+def seed(users, rng, stale=200, batch_size=5000):
+    # Deterministic synthetic dataset: `users` users, one company for every
+    # USERS_PER_COMPANY users, a round-robin membership per user, a hot company
+    # with many members and a first user that belongs to many companies. The
+    # first `stale` companies are due for maintenance.
+    from django.contrib.auth.hashers import make_password
+    from django.utils import timezone
+    from rest_framework.authtoken.models import Token
+
+    from restapi.bulk import chunked
+    from restapi.models import Company, User
+
+    password = make_password(PASSWORD)
+    for start in range(0, users, batch_size):
+        User.objects.bulk_create([
+            User(first_name=f'user{index}', last_name='bench', email=f'bench-{index}@example.com', password=password)
+            for index in range(start, min(start + batch_size, users))
+        ])
+    user_ids = list(User.objects.filter(email__startswith='bench-').order_by('id').values_list('id', flat=True))
+
+    companies = max(1, users // USERS_PER_COMPANY)
+    old_check = timezone.localtime() - timedelta(days=62)
+    for start in range(0, companies, batch_size):
+        Company.objects.bulk_create([
+            Company(
+                corporate_name=f'Empresa {index}',
+                trade_name=f'Fantasia {index}',
+                cnpj=f'{index:014d}',
+                **({'last_check': old_check} if index < stale else {})
+            )
+            for index in range(start, min(start + batch_size, companies))
+        ])
+    company_ids = list(Company.objects.order_by('id').values_list('id', flat=True))
+
+    links = {(company_ids[index % companies], user_id) for index, user_id in enumerate(user_ids)}
+    links.update((company_ids[0], user_id) for user_id in rng.sample(user_ids, min(HOT_COMPANY_MEMBERS, users)))
+    links.update((company_id, user_ids[0]) for company_id in company_ids[:USER_COMPANIES])
+    through = Company.user.through
+    for chunk in chunked(sorted(links), batch_size):
+        through.objects.bulk_create([through(company_id=company_id, user_id=user_id) for company_id, user_id in chunk])
+
+    admin = User.objects.create_superuser('bench', 'admin', 'bench-admin@example.com', PASSWORD)
+    return {
+        'users': len(user_ids),
+        'companies': companies,
+        'memberships': len(links),
+        'stale_companies': min(stale, companies),
+        'user_ids': user_ids,
+        'company_ids': company_ids,
+        'token': Token.objects.get_or_create(user_id=user_ids[0])[0].key,
+        'admin_token': Token.objects.get_or_create(user=admin)[0].key,
+    }
+
+
+def scenarios(dataset, lookup_cnpjs, bulk_size):
+    # Each scenario maps an iteration number to (method, path, request kwargs).
+    # Anything it does itself, such as creating a token, is not timed.
+    from rest_framework.authtoken.models import Token
+
+    user_ids, company_ids = dataset['user_ids'], dataset['company_ids']
+    spare_users = user_ids[len(user_ids) // 2:] or user_ids
+    user = {'HTTP_AUTHORIZATION': f'Token {dataset["token"]}'}
+    admin = {'HTTP_AUTHORIZATION': f'Token {dataset["admin_token"]}'}
+
+    def new_cnpj(prefix, index):
+        return f'{prefix}{index:013d}'
+
+    def logout(index):
+        user_id = user_ids[-1]
+        Token.objects.filter(user_id=user_id).delete()
+        key = Token.objects.create(user_id=user_id).key
+        return 'post', '/api/logout/', {'HTTP_AUTHORIZATION': f'Token {key}'}
+
+    return {
+        'api-root': lambda index: ('get', '/api/', {}),
+        'user-list': lambda index: ('post', '/api/user/', {'data': {
+            'first_name': 'new', 'last_name': 'user', 'email': f'new-{index}@example.com', 'password': PASSWORD,
+        }}),
+        'api_login': lambda index: ('post', '/api/login/', {'data': {
+            'username': f'bench-{index % len(user_ids)}@example.com', 'password': PASSWORD,
+        }}),
+        'api_logout': logout,
+        'api_metrics': lambda index: ('get', '/api/metrics/', admin),
+        'api_metrics_prometheus': lambda index: ('get', '/api/metrics/prometheus/', admin),
+        'user-companies': lambda index: ('get', '/api/user/companies/', user),
+        'company-members': lambda index: ('get', f'/api/company/{company_ids[0]}/members/', user),
+        'company-changes': lambda index: ('get', '/api/company/changes/', admin),
+        'company-export': lambda index: ('get', '/api/company/export/?output=csv', admin),
+        'company-members-export': lambda index: ('get', '/api/company/members/export/', admin),
+        'company-create': lambda index: ('post', '/api/company/', {'data': {
+            'corporate_name': 'new', 'trade_name': 'company', 'cnpj': new_cnpj(8, index), 'user': [user_ids[0]],
+        }}),
+        'company-create:enrich': lambda index: ('post', '/api/company/?enrich=true', {'data': {
+            'corporate_name': '', 'trade_name': '', 'cnpj': lookup_cnpjs[index], 'user': [user_ids[0]],
+        }, **user}),
+        'company-lookup': lambda index: ('get', f'/api/company/lookup/{lookup_cnpjs[index]}/', user),
+        'company-bulk': lambda index: ('post', '/api/company/bulk/', {'data': [
+            {'corporate_name': 'bulk', 'trade_name': 'company', 'cnpj': new_cnpj(7, index * bulk_size + offset), 'user': [user_ids[0]]}
+            for offset in range(bulk_size)
+        ], **user}),
+        'company-registry-member': lambda index: ('post', '/api/company/members/registry/', {'data': {
+            'company_id': company_ids[-1], 'user_id': spare_users[index % len(spare_users)],
+        }, **user}),
+        'company-registry-members-bulk': lambda index: ('post', '/api/company/members/registry/bulk/', {'data': {
+            'company_id': company_ids[index % len(company_ids)],
+            'user_ids': spare_users[(index * bulk_size) % len(spare_users):][:bulk_size],
+        }, **user}),
+    }
+
+
+def summarize(latencies, queries, statuses):
+    return {
+        'iterations': len(latencies),
+        'mean_ms': statistics.fmean(latencies),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'queries_mean': statistics.fmean(queries),
+        'queries_max': max(queries),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def measure(client, request, iterations, warmup):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    latencies, queries, statuses = [], [], Counter()
+    for index in range(warmup + iterations):
+        method, path, kwargs = request(index)
+        with CaptureQueriesContext(connection) as captured:
+            started_at = time.perf_counter()
+            response = getattr(client, method)(path, format='json', **kwargs)
+            if response.streaming:
+                # Streamed bodies only hit the database while being consumed.
+                b''.join(response.streaming_content)
+            elapsed = (time.perf_counter() - started_at) * 1000
+        if index >= warmup:
+            latencies.append(elapsed)
+            queries.append(len(captured))
+            statuses[response.status_code] += 1
+    return summarize(latencies, queries, statuses)
+
+
+def measure_maintenance():
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from restapi.tasks import periodic_companies_maintenance
+
+    with CaptureQueriesContext(connection) as captured:
+        started_at = time.perf_counter()
+        result = periodic_companies_maintenance()
+        elapsed = time.perf_counter() - started_at
+    if isinstance(result, dict):
+        raise RuntimeError(f'periodic_companies_maintenance failed: {result}')
+    return {
+        'companies': len(result),
+        'seconds': elapsed,
+        'companies_per_second': len(result) / elapsed if elapsed else 0,
+        'queries': len(captured),
+    }
+
+
+def run_suite(users, seed_value=0, iterations=50, warmup=5, stale=200, bulk_size=100, response_cache=False):
+    # Seeds the current database and benchmarks every API route plus the
+    # maintenance task against a local stand-in for receitaws.
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test import override_settings
+    from rest_framework.test import APIClient
+
+    from restapi.cnpj import cnpj_cache
+    from restapi.models import Company
+    from benchmarks.stub import StubCNPJServer, company_payload
+
+    missing = route_names() - SHADOWED_ROUTES
+    rng = random.Random(seed_value)
+    started_at = time.perf_counter()
+    dataset = seed(users, rng, stale=stale)
+    seeding_seconds = time.perf_counter() - started_at
+
+    lookup_cnpjs = [f'9{index:013d}' for index in range(warmup + iterations)]
+    payloads = {cnpj: company_payload(f'Consulta {cnpj}', 'Consulta') for cnpj in lookup_cnpjs}
+    for cnpj in Company.objects.necessary_to_check().values_list('cnpj', flat=True):
+        # Every other stale company comes back renamed, so both the changed and
+        # the unchanged refresh paths are exercised.
+        index = int(cnpj)
+        payloads[cnpj] = company_payload(f'Empresa {index}' + (' LTDA' if index % 2 else ''), f'Fantasia {index}', 'Ativa')
+
+    report = {'routes': {}}
+    with StubCNPJServer(payloads) as stub, override_settings(
+        CNPJ_API_URL=stub.url,
+        CNPJ_API_RATE_LIMIT=10 ** 9,
+        CNPJ_LOOKUP_USER_RATE_LIMIT=10 ** 9,
+        CNPJ_API_RETRIES=0,
+        COMPANIES_MAINTENANCE_FANOUT=False,
+        COMPANY_CHANGES_SAFETY_LAG=0,
+        RESPONSE_CACHE_ENABLED=response_cache,
+    ):
+        cache.clear()
+        cnpj_cache.clear_local()
+        client = APIClient()
+        for name, request in scenarios(dataset, lookup_cnpjs, bulk_size).items():
+            report['routes'][name] = measure(client, request, iterations, warmup)
+            missing.discard(name.split(':')[0])
+        report['maintenance'] = measure_maintenance()
+    if missing:
+        raise RuntimeError(f'no benchmark for routes: {", ".join(sorted(missing))}')
+
+    report['meta'] = {
+        'users': dataset['users'],
+        'companies': dataset['companies'],
+        'memberships': dataset['memberships'],
+        'stale_companies': dataset['stale_companies'],
+        'seed': seed_value,
+        'iterations': iterations,
+        'warmup': warmup,
+        'response_cache': response_cache,
+        'seeding_seconds': seeding_seconds,
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+    }
+    return report
+
+
+def compare(baseline, report, tolerance):
+    # Lists routes whose p95 grew by more than `tolerance` or that issue more
+    # queries than in `baseline`.
+    regressions = []
+    for name, current in report['routes'].items():
+        previous = baseline.get('routes', {}).get(name)
+        if previous is None:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append({'route': name, 'metric': 'p95_ms', 'baseline': previous['p95_ms'], 'current': current['p95_ms']})
+        if current['queries_max'] > previous['queries_max']:
+            regressions.append({'route': name, 'metric': 'queries_max', 'baseline': previous['queries_max'], 'current': current['queries_max']})
+    previous = baseline.get('maintenance')
+    if previous and report['maintenance']['queries'] > previous['queries']:
+        regressions.append({
+            'route': 'maintenance', 'metric': 'queries',
+            'baseline': previous['queries'], 'current': report['maintenance']['queries'],
+        })
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seeds a throwaway database and benchmarks the API routes and the maintenance task.')
+    parser.add_argument('--scale', type=parse_scale, default='1k', help='1k, 100k, 1m or a number of users.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--stale', type=int, default=200, help='Companies due for maintenance.')
+    parser.add_argument('--bulk-size', type=int, default=100, help='Items per request on the bulk routes.')
+    parser.add_argument('--response-cache', action='store_true', help='Keep the response cache on for the read routes.')
+    parser.add_argument('--keepdb', action='store_true', help='Keep the benchmark database after the run.')
+    parser.add_argument('--output', help='Writes the JSON report to this file as well.')
+    parser.add_argument('--compare', help='Baseline report; exits with 1 when a route regressed.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed p95 growth over the baseline.')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'saas.settings')
+    django.setup()
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    # The dataset goes to the test database, never to the configured one.
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, keepdb=args.keepdb)
+    try:
+        report = run_suite(
+            args.scale, seed_value=args.seed, iterations=args.iterations, warmup=args.warmup,
+            stale=args.stale, bulk_size=args.bulk_size, response_cache=args.response_cache,
+        )
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=args.keepdb)
+        teardown_test_environment()
+    report['meta']['revision'] = git_revision()
+
+    if args.compare:
+        with open(args.compare) as stream:
+            report['regressions'] = compare(json.load(stream), report, args.tolerance)
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as stream:
+            stream.write(output)
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+import multiprocessing
+import os
+
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '1000'))
+
+# Load Django once in the master and fork the workers from it. Database
+# connections are only opened lazily, inside each worker.
+preload_app = True
+
+# Uvicorn workers serve the ASGI application, every other worker class the WSGI one.
+if worker_class.startswith('uvicorn'):
+    wsgi_app = 'saas.asgi:application'
+else:
+    wsgi_app = 'saas.wsgi:application'
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-') or None
+errorlog = '-'
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class RestApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'restapi'
+
+    def ready(self):
+        from . import authentication, metrics, response_cache, tasks, token  # noqa: F401
+        metrics.register_collector(metrics.collect_db_pools)
+        metrics.register_collector(metrics.collect_cache_hit_ratios)
+        metrics.register_collector(tasks.collect_maintenance_runs, shared=True)
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .cache import TieredCache
+from .models import User
+from .timing import stage
+
+
+token_cache = TieredCache(
+    'auth_token',
+    maxsize=settings.AUTH_TOKEN_CACHE_MAXSIZE,
+    local_ttl=settings.AUTH_TOKEN_CACHE_LOCAL_TTL,
+)
+
+
+# What a cached entry keeps of the user, in model field order as from_db()
+# expects. The password hash is never cached; it is a deferred field on the
+# rebuilt user.
+CACHED_USER_FIELDS = tuple(field.attname for field in User._meta.concrete_fields if field.attname != 'password')
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    # TokenAuthentication that remembers token -> user lookups. Entries are
+    # dropped when the token is deleted or its user is saved. Only plain values
+    # are cached and every request gets its own User and Token instances.
+
+    def authenticate(self, request):
+        with stage('auth'):
+            return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        if entry is None:
+            user, token = super().authenticate_credentials(key)
+            entry = (tuple(getattr(user, field) for field in CACHED_USER_FIELDS), token.created)
+            token_cache.set(key, entry, settings.AUTH_TOKEN_CACHE_TTL)
+            return user, token
+        user_values, created = entry
+        user = User.from_db(None, CACHED_USER_FIELDS, user_values)
+        token = Token.from_db(None, ('key', 'user_id', 'created'), (key, user.pk, created))
+        token.user = user
+        return user, token
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created=False, **kwargs):
+    if not created:
+        for key in Token.objects.filter(user_id=instance.pk).values_list('key', flat=True):
+            token_cache.delete(key)
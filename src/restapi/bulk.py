@@ -0,0 +1,156 @@
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import Company, User
+from .response_cache import invalidate_companies
+from .serializers import CompanySerializer
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _build_company(validated):
+    return Company(
+        corporate_name=validated['corporate_name'],
+        trade_name=validated['trade_name'],
+        cnpj=validated['cnpj'],
+    )
+
+
+def _member_links(companies, items):
+    through = Company.user.through
+    return [
+        through(company_id=company.id, user_id=user_id)
+        for company, (_, validated) in zip(companies, items)
+        for user_id in {user.id for user in validated.get('user', [])}
+    ]
+
+
+def _create_companies(items, batch_size):
+    companies = [_build_company(validated) for _, validated in items]
+    Company.objects.bulk_create(companies, batch_size=batch_size)
+    Company.user.through.objects.bulk_create(_member_links(companies, items), batch_size=batch_size)
+    return companies
+
+
+def _create_chunk(items, batch_size):
+    # A conflicting row makes the whole chunk fail, so retry it row by row to
+    # keep the rows that can still be inserted.
+    try:
+        with transaction.atomic():
+            companies = _create_companies(items, batch_size)
+        return [(index, company, None) for (index, _), company in zip(items, companies)]
+    except IntegrityError:
+        pass
+    results = []
+    for item in items:
+        try:
+            with transaction.atomic():
+                company, = _create_companies([item], batch_size)
+        except IntegrityError as exc:
+            results.append((item[0], None, {'non_field_errors': [str(exc)]}))
+        else:
+            results.append((item[0], company, None))
+    return results
+
+
+def register_companies(data, atomic=False, batch_size=None):
+    batch_size = batch_size or settings.BULK_CREATE_BATCH_SIZE
+    serializer = CompanySerializer(data=data, many=True)
+    is_valid = serializer.is_valid()
+    results = [None] * len(data)
+    if not is_valid:
+        for index, errors in enumerate(serializer.errors):
+            if errors:
+                results[index] = {'index': index, 'status': 'invalid', 'errors': errors}
+
+    pending = []
+    seen_cnpjs = set()
+    for index, validated in serializer.valid_items:
+        if validated['cnpj'] in seen_cnpjs:
+            errors = {'cnpj': ['cnpj repetido nesta requisição.']}
+            results[index] = {'index': index, 'status': 'invalid', 'errors': errors}
+        else:
+            seen_cnpjs.add(validated['cnpj'])
+            pending.append((index, validated))
+
+    if atomic and len(pending) < len(data):
+        for index, _ in pending:
+            results[index] = {'index': index, 'status': 'skipped'}
+        return results
+
+    try:
+        with transaction.atomic() if atomic else nullcontext():
+            for items in chunked(pending, batch_size):
+                if atomic:
+                    companies = _create_companies(items, batch_size)
+                    created = [(index, company, None) for (index, _), company in zip(items, companies)]
+                else:
+                    created = _create_chunk(items, batch_size)
+                for index, company, errors in created:
+                    if company is None:
+                        results[index] = {'index': index, 'status': 'failed', 'errors': errors}
+                    else:
+                        results[index] = {'index': index, 'status': 'created', 'id': company.id}
+    except IntegrityError as exc:
+        for index, _ in pending:
+            results[index] = {'index': index, 'status': 'failed', 'errors': {'non_field_errors': [str(exc)]}}
+    # bulk_create sends no m2m_changed, so the members' cached listings are dropped here.
+    invalidate_companies([result['id'] for result in results if result['status'] == 'created'])
+    return results
+
+
+def _parse_id(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def register_members(pairs, batch_size=None):
+    # Resolves companies, users and existing memberships with one query each
+    # and inserts the missing memberships in bulk.
+    batch_size = batch_size or settings.BULK_CREATE_BATCH_SIZE
+    report = {'added': [], 'already_present': [], 'invalid': []}
+    parsed = []
+    for company_id, user_id in pairs:
+        pair = (_parse_id(company_id), _parse_id(user_id))
+        if None in pair:
+            report['invalid'].append({'company_id': company_id, 'user_id': user_id, 'error': 'invalid id'})
+        else:
+            parsed.append(pair)
+
+    company_ids = {company_id for company_id, _ in parsed}
+    user_ids = {user_id for _, user_id in parsed}
+    existing_companies = set(Company.objects.filter(id__in=company_ids).values_list('id', flat=True))
+    existing_users = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+    through = Company.user.through
+    memberships = set(
+        through.objects.filter(company_id__in=existing_companies, user_id__in=existing_users)
+        .values_list('company_id', 'user_id')
+    )
+
+    new_links = []
+    seen = set()
+    for company_id, user_id in parsed:
+        pair = {'company_id': company_id, 'user_id': user_id}
+        if company_id not in existing_companies:
+            report['invalid'].append({**pair, 'error': 'company not found'})
+        elif user_id not in existing_users:
+            report['invalid'].append({**pair, 'error': 'user not found'})
+        elif (company_id, user_id) in memberships or (company_id, user_id) in seen:
+            report['already_present'].append(pair)
+        else:
+            seen.add((company_id, user_id))
+            new_links.append(through(company_id=company_id, user_id=user_id))
+            report['added'].append(pair)
+
+    through.objects.bulk_create(new_links, batch_size=batch_size, ignore_conflicts=True)
+    invalidate_companies({link.company_id for link in new_links})
+    return report
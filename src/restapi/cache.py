@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache as shared_cache
+
+from . import metrics
+
+
+class LocalCache:
+    # In-process LRU where every entry carries its own expiry time.
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class TieredCache:
+    # Local LRU in front of the shared Django cache. Entries found in the shared
+    # tier are promoted to the local one for the rest of their lifetime, capped
+    # by `local_ttl` when deletes must reach other processes quickly.
+
+    def __init__(self, name, maxsize=1024, shared=True, local_ttl=None):
+        self.name = name
+        self.shared = shared
+        self.local_ttl = local_ttl
+        self.local = LocalCache(maxsize)
+
+    def _set_local(self, key, value, ttl):
+        if self.local_ttl is not None:
+            ttl = min(ttl, self.local_ttl)
+        if ttl > 0:
+            self.local.set(key, value, time.monotonic() + ttl)
+
+    def _shared_key(self, key):
+        return f'{self.name}:{key}'
+
+    def get(self, key):
+        entry = self.local.get(key)
+        if entry is not None:
+            metrics.incr('cache_hits', cache=self.name, tier='local')
+            return entry[1]
+        if self.shared:
+            entry = shared_cache.get(self._shared_key(key))
+            if entry is not None:
+                expires_at, value = entry
+                ttl = expires_at - time.time()
+                if ttl > 0:
+                    self._set_local(key, value, ttl)
+                    metrics.incr('cache_hits', cache=self.name, tier='shared')
+                    return value
+        metrics.incr('cache_misses', cache=self.name)
+        return None
+
+    def set(self, key, value, ttl):
+        self._set_local(key, value, ttl)
+        if self.shared:
+            shared_cache.set(self._shared_key(key), (time.time() + ttl, value), timeout=ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared:
+            shared_cache.delete(self._shared_key(key))
+
+    def clear_local(self):
+        self.local.clear()
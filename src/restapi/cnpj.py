@@ -0,0 +1,245 @@
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+from .cache import TieredCache
+from .ratelimit import RateLimiter, RateLimitExceeded
+from .timing import stage
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CNPJLookupError(Exception):
+    pass
+
+
+class CNPJRateLimitError(RateLimitExceeded):
+    pass
+
+
+cnpj_cache = TieredCache('cnpj', maxsize=settings.CNPJ_CACHE_MAXSIZE)
+
+
+def cache_payload(cnpj, payload):
+    if payload.get('status') == 'ERROR':
+        ttl = settings.CNPJ_CACHE_ERROR_TTL
+    else:
+        ttl = settings.CNPJ_CACHE_TTL
+    cnpj_cache.set(cnpj, payload, ttl)
+
+
+def get_cnpj_api_rate_limiter():
+    return RateLimiter('receitaws', settings.CNPJ_API_RATE_LIMIT, settings.CNPJ_API_RATE_PERIOD)
+
+
+def observe_api_call(started_at, status):
+    metrics.observe('cnpj_api_seconds', time.perf_counter() - started_at, status=status)
+
+
+def parse_company_data(cnpj, payload):
+    if payload.get('status') == 'ERROR':
+        raise CNPJLookupError(f'Não foi possível obter os dados da empresa {cnpj}')
+    return {
+        'nome': payload['nome'],
+        'fantasia': payload['fantasia'],
+        'situacao': payload['situacao']
+    }
+
+
+class CNPJClient:
+
+    def __init__(self, base_url=None, connect_timeout=None, read_timeout=None,
+                 retries=None, backoff_factor=None, pool_size=None, rate_limiter=None, max_wait=None):
+        self.base_url = base_url or settings.CNPJ_API_URL
+        self.rate_limiter = rate_limiter or get_cnpj_api_rate_limiter()
+        self.max_wait = max_wait
+        self.retries = settings.CNPJ_API_RETRIES if retries is None else retries
+        self.backoff_factor = settings.CNPJ_API_BACKOFF_FACTOR if backoff_factor is None else backoff_factor
+        self.timeout = (
+            connect_timeout or settings.CNPJ_API_CONNECT_TIMEOUT,
+            read_timeout or settings.CNPJ_API_READ_TIMEOUT,
+        )
+        pool_size = pool_size or settings.CNPJ_API_POOL_SIZE
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def acquire(self):
+        try:
+            self.rate_limiter.acquire(self.max_wait)
+        except RateLimitExceeded as e:
+            raise CNPJRateLimitError(e.wait) from None
+
+    def lookup(self, cnpj):
+        # Retries are requests too: every attempt takes a rate limit token.
+        url = f'{self.base_url}cnpj/{cnpj}'
+        for attempt in range(self.retries + 1):
+            self.acquire()
+            started_at = time.perf_counter()
+            try:
+                with stage('cnpj_api'):
+                    response = self.session.get(url, timeout=self.timeout)
+            except requests.RequestException:
+                observe_api_call(started_at, 'error')
+                if attempt == self.retries:
+                    raise
+            else:
+                observe_api_call(started_at, response.status_code)
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    response.raise_for_status()
+                    return response.json()
+            time.sleep(self.backoff_factor * (2 ** attempt))
+
+    def get_company_data(self, cnpj):
+        payload = cnpj_cache.get(cnpj)
+        if payload is None:
+            payload = self.lookup(cnpj)
+            cache_payload(cnpj, payload)
+        return parse_company_data(cnpj, payload)
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncCNPJClient:
+
+    def __init__(self, base_url=None, connect_timeout=None, read_timeout=None,
+                 retries=None, backoff_factor=None, concurrency=None, rate_limiter=None, max_wait=None):
+        self.base_url = base_url or settings.CNPJ_API_URL
+        self.rate_limiter = rate_limiter or get_cnpj_api_rate_limiter()
+        self.max_wait = max_wait
+        self.retries = settings.CNPJ_API_RETRIES if retries is None else retries
+        self.backoff_factor = settings.CNPJ_API_BACKOFF_FACTOR if backoff_factor is None else backoff_factor
+        self.concurrency = concurrency or settings.CNPJ_API_CONCURRENCY
+        timeout = httpx.Timeout(
+            read_timeout or settings.CNPJ_API_READ_TIMEOUT,
+            connect=connect_timeout or settings.CNPJ_API_CONNECT_TIMEOUT,
+        )
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        self.client = httpx.AsyncClient(timeout=timeout, limits=limits)
+
+    async def acquire(self):
+        waited = 0
+        try:
+            with stage('rate_limit'):
+                while True:
+                    wait = await sync_to_async(self.rate_limiter.try_acquire)()
+                    if not wait:
+                        return
+                    if self.max_wait is not None and waited + wait > self.max_wait:
+                        raise CNPJRateLimitError(wait)
+                    await asyncio.sleep(wait)
+                    waited += wait
+        finally:
+            if waited:
+                metrics.observe('ratelimit_wait_seconds', waited, limiter=self.rate_limiter.name)
+
+    async def lookup(self, cnpj):
+        url = f'{self.base_url}cnpj/{cnpj}'
+        for attempt in range(self.retries + 1):
+            await self.acquire()
+            started_at = time.perf_counter()
+            try:
+                with stage('cnpj_api'):
+                    response = await self.client.get(url)
+            except httpx.TransportError:
+                observe_api_call(started_at, 'error')
+                if attempt == self.retries:
+                    raise
+            else:
+                observe_api_call(started_at, response.status_code)
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    response.raise_for_status()
+                    return response.json()
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+
+    async def get_company_data(self, cnpj):
+        payload = await sync_to_async(cnpj_cache.get)(cnpj)
+        if payload is None:
+            payload = await self.lookup(cnpj)
+            await sync_to_async(cache_payload)(cnpj, payload)
+        return parse_company_data(cnpj, payload)
+
+    async def get_many_company_data(self, cnpjs):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(cnpj):
+            async with semaphore:
+                return await self.get_company_data(cnpj)
+
+        results = await asyncio.gather(*(bounded(cnpj) for cnpj in cnpjs), return_exceptions=True)
+        return dict(zip(cnpjs, results))
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+_client = None
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_cnpj_client():
+    # Used by the celery tasks, which retry later rather than sleeping through
+    # a long rate limit wait.
+    global _client
+    if _client is None:
+        _client = CNPJClient(max_wait=settings.CNPJ_API_MAX_WAIT)
+    return _client
+
+
+def get_async_cnpj_client():
+    # One client per event loop, so an ASGI worker keeps reusing its pooled
+    # connections.
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncCNPJClient(max_wait=settings.CNPJ_API_MAX_WAIT)
+    return client
+
+
+@asynccontextmanager
+async def async_cnpj_client():
+    # Under WSGI every async view call runs on a loop of its own, so its client
+    # is closed with the call instead of leaking the connections.
+    if settings.ASGI:
+        yield get_async_cnpj_client()
+    else:
+        async with AsyncCNPJClient(max_wait=settings.CNPJ_API_MAX_WAIT) as client:
+            yield client
+
+
+@receiver(setting_changed)
+def reset_cnpj_client(setting, **kwargs):
+    global _client
+    if not setting.startswith('CNPJ_API_'):
+        return
+    if _client is not None:
+        _client.close()
+        _client = None
+    _async_clients.clear()
+
+
+def get_many_company_data(cnpjs):
+    async def resolve():
+        async with AsyncCNPJClient() as client:
+            return await client.get_many_company_data(cnpjs)
+
+    return asyncio.run(resolve())
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.db.models import F
+
+from .models import Company
+from .streaming import iter_csv, iter_ndjson
+
+
+COMPANY_FIELDS = ('id', 'corporate_name', 'trade_name', 'cnpj', 'status')
+MEMBER_FIELDS = ('company_id', 'user_id', 'first_name', 'last_name', 'email')
+OUTPUTS = ('ndjson', 'csv')
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+
+Membership = Company.user.through
+
+
+def company_rows(user=None):
+    # Plain dicts from values() read through iterator(), which uses a server
+    # side cursor on PostgreSQL, so no model instance or full result list is
+    # ever built.
+    queryset = Company.objects.all()
+    if user is not None:
+        queryset = queryset.filter(user=user)
+    return queryset.order_by('id').values(*COMPANY_FIELDS).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+
+
+def member_rows(company_ids=None, user=None):
+    # One row per membership, read from the join table with the user columns
+    # alongside. With a user, only companies that user belongs to are exported.
+    queryset = Membership.objects.all()
+    if company_ids is not None:
+        queryset = queryset.filter(company_id__in=company_ids)
+    if user is not None:
+        queryset = queryset.filter(company__user=user)
+    return queryset.order_by('company_id', 'user_id').values(
+        'company_id', 'user_id',
+        first_name=F('user__first_name'), last_name=F('user__last_name'), email=F('user__email'),
+    ).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+
+
+def encode(rows, fields, output):
+    if output == 'csv':
+        return iter_csv(rows, fields)
+    return iter_ndjson(rows)
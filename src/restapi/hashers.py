@@ -0,0 +1,139 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher, BasePasswordHasher, PBKDF2PasswordHasher, identify_hasher, make_password,
+)
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import receiver
+from django.utils.translation import gettext_noop as _
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    # Django's PBKDF2 with PASSWORD_PBKDF2_ITERATIONS. The algorithm name is
+    # unchanged, so existing hashes verify and are upgraded on login.
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM
+
+
+class TransitionalPasswordHasher(PBKDF2PasswordHasher):
+    # Cheap salted hash written at signup when PASSWORD_SIGNUP_DEFERRED_HASHING
+    # is on. It only lives until upgrade_password_hashes wraps it with the
+    # preferred hasher, a few seconds later.
+    algorithm = 'pbkdf2_transitional'
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_TRANSITIONAL_ITERATIONS
+
+
+class WrappedTransitionalPasswordHasher(BasePasswordHasher):
+    # The preferred hasher applied to a transitional hash with the same salt,
+    # so the slow part of a deferred signup runs without the raw password:
+    #   wrapped$<transitional iterations>$<preferred hash of the digest>
+    # Always reported as stale, the next login stores a plain preferred hash.
+    algorithm = 'wrapped'
+
+    def encode(self, password, salt):
+        return wrap(TransitionalPasswordHasher().encode(password, salt))
+
+    def decode(self, encoded):
+        algorithm, iterations, inner = encoded.split('$', 2)
+        assert algorithm == self.algorithm
+        hasher = identify_hasher(inner)
+        return {
+            'algorithm': algorithm,
+            'iterations': int(iterations),
+            'salt': hasher.decode(inner)['salt'],
+            'hasher': hasher,
+            'hash': inner,
+        }
+
+    def verify(self, password, encoded):
+        try:
+            decoded = self.decode(encoded)
+        except ValueError:
+            return False
+        transitional = TransitionalPasswordHasher().encode(password, decoded['salt'], decoded['iterations'])
+        return decoded['hasher'].verify(transitional.rsplit('$', 1)[1], decoded['hash'])
+
+    def safe_summary(self, encoded):
+        decoded = self.decode(encoded)
+        summary = decoded['hasher'].safe_summary(decoded['hash'])
+        summary[_('algorithm')] = f'{decoded["algorithm"]} {decoded["hasher"].algorithm}'
+        return summary
+
+    def must_update(self, encoded):
+        return True
+
+
+def is_transitional(encoded):
+    return encoded.startswith(f'{TransitionalPasswordHasher.algorithm}$')
+
+
+def wrap(encoded):
+    # Turns a transitional hash into a wrapped one, with the preferred hasher.
+    decoded = TransitionalPasswordHasher().decode(encoded)
+    wrapped = make_password(decoded['hash'], decoded['salt'])
+    return f'{WrappedTransitionalPasswordHasher.algorithm}${decoded["iterations"]}${wrapped}'
+
+
+_executor = None
+
+
+def _rehash(user_model, user_id, encoded, raw_password):
+    try:
+        # Only replaces the hash that was checked, so a password changed in
+        # the meantime is kept.
+        updated = user_model.objects.filter(pk=user_id, password=encoded).update(password=make_password(raw_password))
+        metrics.incr('password_rehashes', updated)
+    except Exception:
+        logger.exception('Could not upgrade the password hash of user %s', user_id)
+    finally:
+        if settings.PASSWORD_REHASH_WORKERS:
+            connections.close_all()
+
+
+def rehash_in_background(user, encoded, raw_password):
+    # Stores `raw_password` with the preferred hasher after a login matched the
+    # stale `encoded` hash, in a thread so the response does not wait for it.
+    # The hashers release the GIL while hashing. With PASSWORD_REHASH_WORKERS
+    # set to 0 it runs inline.
+    global _executor
+    if not settings.PASSWORD_REHASH_WORKERS:
+        return _rehash(type(user), user.pk, encoded, raw_password)
+    if _executor is None:
+        _executor = ThreadPoolExecutor(settings.PASSWORD_REHASH_WORKERS, thread_name_prefix='password-rehash')
+    _executor.submit(_rehash, type(user), user.pk, encoded, raw_password)
+
+
+@receiver(setting_changed)
+def reset_rehash_executor(setting, **kwargs):
+    global _executor
+    if setting == 'PASSWORD_REHASH_WORKERS' and _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
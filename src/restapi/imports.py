@@ -0,0 +1,112 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from rest_framework.authtoken.models import Token
+
+from .models import User
+
+
+USER_FIELDS = ('first_name', 'last_name', 'email', 'password')
+
+
+def read_rows(stream, input_format):
+    if input_format == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                raise ValueError(f'NDJSON parse error on line {number} - {exc}')
+
+
+def _init_hashing_worker():
+    django.setup()
+
+
+def _clean_row(row):
+    values = {field: (row.get(field) or '').strip() for field in USER_FIELDS}
+    if not all(values.values()):
+        return None
+    values['email'] = User.objects.normalize_email(values['email'])
+    return values
+
+
+def _import_chunk(rows, hash_passwords):
+    users = []
+    seen = set()
+    for row in rows:
+        if row is not None and row['email'] not in seen:
+            seen.add(row['email'])
+            users.append(row)
+    existing = set(User.objects.filter(email__in=seen).values_list('email', flat=True))
+    users = [row for row in users if row['email'] not in existing]
+    hashes = hash_passwords([row['password'] for row in users])
+    instances = [
+        User(first_name=row['first_name'], last_name=row['last_name'], email=row['email'], password=password)
+        for row, password in zip(users, hashes)
+    ]
+    try:
+        _insert_users(instances)
+    except IntegrityError:
+        # An email was taken since the check above, by a concurrent signup or
+        # one the database collation treats as equal. Insert row by row and
+        # count the conflicting rows as skipped.
+        created = 0
+        for instance in instances:
+            try:
+                _insert_users([instance])
+            except IntegrityError:
+                continue
+            created += 1
+        return created
+    return len(instances)
+
+
+def _insert_users(instances):
+    with transaction.atomic():
+        User.objects.bulk_create(instances)
+        Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in instances])
+
+
+def _import_rows(rows, batch_size, hash_passwords, progress):
+    rows = iter(rows)
+    started_at = time.monotonic()
+    imported = 0
+    skipped = 0
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            return imported, skipped
+        created = _import_chunk([_clean_row(row) for row in chunk], hash_passwords)
+        imported += created
+        skipped += len(chunk) - created
+        if progress is not None:
+            elapsed = time.monotonic() - started_at
+            progress(imported, skipped, imported / elapsed if elapsed else 0)
+
+
+def import_users(rows, batch_size=None, workers=None, progress=None):
+    # Streams `rows` in chunks: passwords are hashed in a process pool since
+    # the hasher is CPU bound, then users and their tokens are bulk inserted.
+    # `workers=0` hashes in the current process.
+    batch_size = batch_size or settings.BULK_CREATE_BATCH_SIZE
+    if workers == 0:
+        return _import_rows(rows, batch_size, lambda passwords: [make_password(p) for p in passwords], progress)
+    workers = workers or os.cpu_count()
+    chunksize = max(1, batch_size // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_hashing_worker) as executor:
+        def hash_passwords(passwords):
+            return list(executor.map(make_password, passwords, chunksize=chunksize))
+
+        return _import_rows(rows, batch_size, hash_passwords, progress)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from restapi.token import create_auth_token_for_all_users
+
+
+class Command(BaseCommand):
+    help = 'Creates an authentication token for every user that does not have one.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        def progress(created, last_id):
+            self.stdout.write(f'{created} tokens created (last user id {last_id})')
+
+        created = create_auth_token_for_all_users(batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'Done: {created} tokens created.'))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from restapi import exports
+from restapi.models import User
+
+
+class Command(BaseCommand):
+    help = 'Streams companies or company members to a CSV or NDJSON file, or to stdout.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['companies', 'members'])
+        parser.add_argument('--path', default=None, help='Output file, stdout when omitted.')
+        parser.add_argument('--output', choices=exports.OUTPUTS, default=None)
+        parser.add_argument('--user', type=int, default=None, help='Only companies this user belongs to.')
+        parser.add_argument('--company', type=int, action='append', default=None, help='Members of this company, can be repeated.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        output = options['output'] or ('csv' if path and path.endswith('.csv') else 'ndjson')
+        user = None
+        if options['user'] is not None:
+            user = User.objects.filter(pk=options['user']).first()
+            if user is None:
+                raise CommandError(f'User {options["user"]} does not exist.')
+
+        if options['kind'] == 'companies':
+            rows, fields = exports.company_rows(user=user), exports.COMPANY_FIELDS
+        else:
+            rows, fields = exports.member_rows(options['company'], user=user), exports.MEMBER_FIELDS
+
+        chunks = exports.encode(rows, fields, output)
+        if not path:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        try:
+            with open(path, 'w', encoding='utf-8', newline='') as stream:
+                stream.writelines(chunks)
+        except OSError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f'Done: {options["kind"]} exported to {path}.'))
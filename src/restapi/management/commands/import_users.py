@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from restapi.imports import import_users, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Imports users from a CSV or NDJSON file with first_name, last_name, email and password.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], default=None)
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--workers', type=int, default=None, help='Password hashing processes, 0 hashes inline.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+
+        def progress(imported, skipped, rate):
+            self.stdout.write(f'{imported} users imported, {skipped} skipped ({rate:.0f} users/s)')
+
+        try:
+            with open(path, encoding='utf-8', newline='') as stream:
+                imported, skipped = import_users(
+                    read_rows(stream, input_format),
+                    batch_size=options['batch_size'],
+                    workers=options['workers'],
+                    progress=progress,
+                )
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f'Done: {imported} users imported, {skipped} skipped.'))
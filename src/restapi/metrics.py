@@ -0,0 +1,189 @@
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+_collectors = []
+_shared_collectors = []
+_published = {'at': 0.0, 'slot': None}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def incr(name, value=1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+    publish_if_due()
+
+
+def get(name, **labels):
+    return _counters.get(_key(name, labels), 0)
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    # Histogram with Prometheus semantics: snapshot() reports cumulative
+    # `{name}_bucket` counts per upper bound plus `{name}_sum` and `{name}_count`.
+    with _lock:
+        histogram = _histograms.get(_key(name, labels))
+        if histogram is None:
+            histogram = _histograms[_key(name, labels)] = {'buckets': buckets, 'counts': [0] * (len(buckets) + 1), 'sum': 0.0}
+        histogram['counts'][bisect_left(histogram['buckets'], value)] += 1
+        histogram['sum'] += value
+    publish_if_due()
+
+
+def get_histogram_count(name, **labels):
+    histogram = _histograms.get(_key(name, labels))
+    return sum(histogram['counts']) if histogram else 0
+
+
+def _histogram_values(name, labels, histogram):
+    cumulative = 0
+    bounds = [*histogram['buckets'], '+Inf']
+    for bound, count in zip(bounds, histogram['counts']):
+        cumulative += count
+        yield {'name': f'{name}_bucket', 'labels': {**labels, 'le': str(bound)}, 'value': cumulative}
+    yield {'name': f'{name}_sum', 'labels': labels, 'value': histogram['sum']}
+    yield {'name': f'{name}_count', 'labels': labels, 'value': cumulative}
+
+
+def register_collector(collector, shared=False):
+    # `collector()` returns (name, labels, value) tuples read at snapshot time,
+    # for values owned by other components such as connection pools. Shared
+    # collectors read state that is already common to every process, such as
+    # the cache, and are not labelled with a process.
+    collectors = _shared_collectors if shared else _collectors
+    if collector not in collectors:
+        collectors.append(collector)
+
+
+def process_snapshot():
+    # This process's counters, histograms and collectors.
+    with _lock:
+        values = [
+            {'name': name, 'labels': dict(labels), 'value': value}
+            for (name, labels), value in sorted(_counters.items())
+        ]
+        for (name, labels), histogram in sorted(_histograms.items()):
+            values.extend(_histogram_values(name, dict(labels), histogram))
+    for collector in _collectors:
+        values.extend({'name': name, 'labels': labels, 'value': value} for name, labels, value in collector())
+    return values
+
+
+def process_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _slot_key(slot):
+    return f'metrics:process:{slot}'
+
+
+def publish():
+    # Every gunicorn worker and celery process has its own registry. Each one
+    # keeps its snapshot in a slot of the shared cache, claimed with an atomic
+    # add, so whichever process serves /api/metrics/ can report all of them.
+    # A process that stops publishing disappears after METRICS_PROCESS_TTL.
+    from django.core.cache import cache
+
+    entry = {'process': process_id(), 'values': process_snapshot()}
+    ttl = settings.METRICS_PROCESS_TTL
+    _published['at'] = time.monotonic()
+    slot = _published['slot']
+    if slot is not None:
+        current = cache.get(_slot_key(slot))
+        if current is None or current['process'] == entry['process']:
+            cache.set(_slot_key(slot), entry, timeout=ttl)
+            return
+    for slot in range(settings.METRICS_MAX_PROCESSES):
+        if cache.add(_slot_key(slot), entry, timeout=ttl):
+            _published['slot'] = slot
+            return
+    _published['slot'] = None
+
+
+def publish_if_due():
+    if time.monotonic() - _published['at'] >= settings.METRICS_PUBLISH_INTERVAL:
+        publish()
+
+
+def snapshot():
+    # Every process's values, labelled with the process they come from, plus
+    # the shared collectors. Sum by the other labels to get totals.
+    from django.core.cache import cache
+
+    publish()
+    entries = cache.get_many([_slot_key(slot) for slot in range(settings.METRICS_MAX_PROCESSES)])
+    values = []
+    for _, entry in sorted(entries.items()):
+        values.extend(
+            {'name': value['name'], 'labels': {**value['labels'], 'process': entry['process']}, 'value': value['value']}
+            for value in entry['values']
+        )
+    for collector in _shared_collectors:
+        values.extend({'name': name, 'labels': labels, 'value': value} for name, labels, value in collector())
+    return values
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in sorted(labels.items())
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def render_prometheus():
+    # Prometheus text exposition format (untyped samples).
+    return ''.join(
+        f'{entry["name"]}{_format_labels(entry["labels"])} {entry["value"]}\n'
+        for entry in snapshot()
+    )
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+    _published['at'] = 0.0
+    if _published['slot'] is not None:
+        from django.core.cache import cache
+
+        cache.delete(_slot_key(_published['slot']))
+        _published['slot'] = None
+
+
+def collect_cache_hit_ratios():
+    with _lock:
+        hits = defaultdict(float)
+        misses = defaultdict(float)
+        for (name, labels), value in _counters.items():
+            labels = dict(labels)
+            if name == 'cache_hits':
+                hits[labels['cache']] += value
+            elif name == 'cache_misses':
+                misses[labels['cache']] += value
+    for cache in sorted({*hits, *misses}):
+        yield 'cache_hit_ratio', {'cache': cache}, hits[cache] / (hits[cache] + misses[cache])
+
+
+def collect_db_pools():
+    from saas.db.base import pool_stats
+
+    for alias, stats in pool_stats().items():
+        for stat, value in stats.items():
+            yield f'db_pool_{stat}', {'alias': alias}, value
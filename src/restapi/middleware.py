@@ -0,0 +1,46 @@
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics, timing
+
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTimingMiddleware:
+    # Records query count, DB time, total time and the stages marked with
+    # timing.stage() for every request, per view. Totals go to the metrics
+    # registry and the request's own numbers to a Server-Timing header. Disabled
+    # unless REQUEST_TIMING_ENABLED, in which case Django drops it at startup.
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with timing.track() as record:
+            response = self.get_response(request)
+        total = record.elapsed()
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        metrics.incr('http_requests', view=view, method=request.method, status=response.status_code)
+        metrics.incr('http_request_seconds_sum', total, view=view)
+        metrics.incr('db_queries', record.queries, view=view)
+        for name, seconds in record.stages.items():
+            metrics.incr(f'{name}_seconds_sum', seconds, view=view)
+
+        repeated = record.repeated_shapes(settings.REQUEST_TIMING_NPLUSONE_THRESHOLD)
+        if repeated:
+            metrics.incr('nplusone_detected', view=view)
+            for shape, count in repeated:
+                logger.warning('Possible N+1 in %s: %d queries like %s', view, count, shape)
+
+        entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in sorted(record.stages.items())]
+        entries.append(f'queries;desc="{record.queries}"')
+        entries.append(f'total;dur={total * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(entries)
+        return response
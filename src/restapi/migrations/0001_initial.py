@@ -0,0 +1,55 @@
+# Generated by Django 4.0.2 on 2026-10-18 12:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.utils.timezone
+import restapi.models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('first_name', models.CharField(max_length=100)),
+                ('last_name', models.CharField(max_length=100)),
+                ('email', models.EmailField(max_length=254, unique=True, verbose_name='e-mail')),
+                ('is_active', models.BooleanField(default=True)),
+                ('is_admin', models.BooleanField(default=False)),
+            ],
+            options={
+                'verbose_name': 'Usuário',
+                'verbose_name_plural': 'Usuários',
+            },
+            managers=[
+                ('objects', restapi.models.UserManager()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Company',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('corporate_name', models.CharField(max_length=100)),
+                ('trade_name', models.CharField(max_length=100)),
+                ('cnpj', models.CharField(max_length=14, unique=True)),
+                ('status', models.CharField(default='Ativa', max_length=100)),
+                ('last_check', models.DateTimeField(default=django.utils.timezone.localtime)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ManyToManyField(blank=True, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Empresa',
+                'verbose_name_plural': 'Empresas',
+            },
+        ),
+    ]
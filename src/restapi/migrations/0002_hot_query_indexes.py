@@ -0,0 +1,26 @@
+# Generated by Django 4.0.2 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['last_check'], name='company_last_check_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['status'], name='company_status_idx'),
+        ),
+        # Lets user -> companies lookups be answered from the index alone.
+        migrations.RunSQL(
+            'CREATE INDEX company_user_user_company_idx ON restapi_company_user (user_id, company_id);',
+            reverse_sql='DROP INDEX company_user_user_company_idx;',
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.0.2 on 2026-10-18 13:03
+
+import random
+from datetime import timedelta
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import migrations, models
+import restapi.models
+
+
+def spread_next_checks(apps, schema_editor):
+    # AddField gives every existing row the same default; schedule each company
+    # from its own last_check instead, with jitter, so they come due spread out.
+    Company = apps.get_model('restapi', 'Company')
+    jitter = settings.COMPANIES_CHECK_JITTER
+    batch = []
+    for company in Company.objects.only('id', 'last_check').iterator(chunk_size=2000):
+        company.next_check_at = (
+            company.last_check + relativedelta(months=1) + timedelta(seconds=random.uniform(-jitter, jitter))
+        )
+        batch.append(company)
+        if len(batch) == 2000:
+            Company.objects.bulk_update(batch, ['next_check_at'])
+            batch = []
+    Company.objects.bulk_update(batch, ['next_check_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0002_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='next_check_at',
+            field=models.DateTimeField(default=restapi.models.default_next_check_at),
+        ),
+        migrations.RunPython(spread_next_checks, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['next_check_at'], name='company_next_check_idx'),
+        ),
+    ]
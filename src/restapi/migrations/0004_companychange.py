@@ -0,0 +1,30 @@
+# Generated by Django 4.0.2 on 2026-10-18 13:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0003_company_next_check_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompanyChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('corporate_name', 'corporate_name'), ('trade_name', 'trade_name'), ('status', 'status')], max_length=20)),
+                ('old_value', models.CharField(max_length=100)),
+                ('new_value', models.CharField(max_length=100)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='restapi.company')),
+            ],
+            options={
+                'verbose_name': 'Alteração de empresa',
+                'verbose_name_plural': 'Alterações de empresas',
+            },
+        ),
+    ]
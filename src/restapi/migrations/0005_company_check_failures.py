@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-18 13:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0004_companychange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='check_failures',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,22 +1,38 @@
-from datetime import date
+import logging
+import random
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
 
 from dateutil.relativedelta import relativedelta
+from django.conf import settings
 from django.utils import timezone
-from django.db import models
+from django.db import connections, models, transaction
+from django.contrib.auth.hashers import check_password, make_password
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 
+from .hashers import rehash_in_background
+
+
+logger = logging.getLogger(__name__)
+
 
 class UserManager(BaseUserManager):
 
     use_in_migrations = True
 
-    def create_user(self, first_name, last_name, email, password=None):
+    def create_user(self, first_name, last_name, email, password=None, defer_hashing=False):
         if self._is_user_valid(first_name, last_name, email, password):
             user = self.model(
                 first_name=first_name,
                 last_name=last_name,
                 email=self.normalize_email(email),
             )
+            if defer_hashing:
+                # A cheap hash now, wrapped with the preferred hasher by a task
+                # once the user is committed.
+                user.password = make_password(password, hasher='pbkdf2_transitional')
+                user.save(using=self._db)
+                transaction.on_commit(lambda: self._upgrade_password_hash(user), using=self._db)
+                return user
             user.set_password(password)
             user.save(using=self._db)
             return user
@@ -33,6 +49,15 @@ class UserManager(BaseUserManager):
             user.save(using=self._db)
             return user
 
+    def _upgrade_password_hash(self, user):
+        # The user is already committed: if the broker is down the signup still
+        # succeeds and the upgrade_password_hashes sweep wraps the hash later.
+        from .tasks import upgrade_password_hashes
+        try:
+            upgrade_password_hashes.delay([user.pk])
+        except Exception:
+            logger.exception('Could not queue the password hash upgrade of user %s', user.pk)
+
     def _is_user_valid(self, first_name, last_name, email, password):
         if first_name is None or last_name is None or email is None or password is None:
             raise TypeError("Arguments can't be None")
@@ -71,11 +96,126 @@ class User(AbstractBaseUser):
     def is_staff(self):
         return self.is_admin
 
+    def check_password(self, raw_password):
+        # A stale hash is replaced in the background instead of during the
+        # login request, see restapi.hashers.rehash_in_background.
+        encoded = self.password
+
+        def setter(raw_password):
+            rehash_in_background(self, encoded, raw_password)
+
+        return check_password(raw_password, encoded, setter)
+
+
+def next_check_after(checked_at):
+    # One month after the check, moved by up to COMPANIES_CHECK_JITTER seconds
+    # either way so companies created or refreshed together drift apart.
+    jitter = random.uniform(-settings.COMPANIES_CHECK_JITTER, settings.COMPANIES_CHECK_JITTER)
+    return checked_at + relativedelta(months=1) + timedelta(seconds=jitter)
+
+
+def retry_check_after(failed_at, failures):
+    # COMPANIES_CHECK_RETRY_DELAY doubled for every consecutive failure, up to
+    # COMPANIES_CHECK_RETRY_MAX_DELAY, so a CNPJ that keeps failing stops
+    # spending the receitaws quota every hour.
+    delay = min(settings.COMPANIES_CHECK_RETRY_DELAY * 2 ** (failures - 1), settings.COMPANIES_CHECK_RETRY_MAX_DELAY)
+    return failed_at + timedelta(seconds=delay * random.uniform(0.9, 1.1))
+
+
+def default_next_check_at():
+    return next_check_after(timezone.localtime())
+
+
+class CompanyQuerySet(models.QuerySet):
+
+    def necessary_to_check(self):
+        # Same rule as Company.is_necessary_to_check, expressed as a range on
+        # last_check so the database can answer it from the index.
+        limit_date = date.today() - relativedelta(months=1) + timedelta(days=1)
+        threshold = datetime.combine(limit_date, time.min, tzinfo=dt_timezone.utc)
+        return self.filter(last_check__lt=threshold)
+
+    def due(self, now=None):
+        return self.filter(next_check_at__lte=now or timezone.now())
+
+    def claim_due(self, limit, lease):
+        # Takes up to `limit` due companies and pushes their next_check_at
+        # `lease` ahead, so overlapping runs skip them and the ones a crashed run
+        # never finished come due again once the lease expires.
+        now = timezone.now()
+        with transaction.atomic(using=self.db):
+            queryset = self.due(now).order_by('next_check_at')
+            if connections[self.db].features.has_select_for_update_skip_locked:
+                queryset = queryset.select_for_update(skip_locked=True)
+            ids = list(queryset.values_list('id', flat=True)[:limit])
+            self.filter(id__in=ids).update(next_check_at=now + lease)
+        return self.filter(id__in=ids)
+
+    def in_batches(self, batch_size=500):
+        last_id = 0
+        while True:
+            batch = list(self.filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1].id
+
+    def apply_refresh(self, refreshed, batch_size=500):
+        # `refreshed` holds (company, corporate_name, trade_name, status) tuples.
+        # Only companies whose data changed are rewritten; the others just get
+        # their last_check advanced.
+        checked_at = timezone.localtime()
+        changed = []
+        unchanged = []
+        changes = []
+        for company, corporate_name, trade_name, status in refreshed:
+            if (company.corporate_name, company.trade_name, company.status) == (corporate_name, trade_name, status):
+                unchanged.append(company)
+            else:
+                changes.extend(CompanyChange.between(company, corporate_name, trade_name, status, checked_at))
+                company.corporate_name = corporate_name
+                company.trade_name = trade_name
+                company.status = status
+                company.updated_at = checked_at
+                changed.append(company)
+            company.last_check = checked_at
+            company.next_check_at = next_check_after(checked_at)
+            company.check_failures = 0
+
+        with transaction.atomic(using=self.db):
+            self.bulk_update(
+                changed,
+                ['corporate_name', 'trade_name', 'status', 'last_check', 'next_check_at', 'check_failures', 'updated_at'],
+                batch_size=batch_size
+            )
+            CompanyChange.objects.bulk_create(changes, batch_size=batch_size)
+            # Every row gets its own jitter, so companies checked together do
+            # not come due together again.
+            self.bulk_update(unchanged, ['last_check', 'next_check_at', 'check_failures'], batch_size=batch_size)
+        # bulk_update sends no signals, so cached listings are dropped here.
+        from .response_cache import invalidate_companies
+        invalidate_companies([company.id for company in changed])
+        return changed
+
+    def defer_failed(self, companies, batch_size=500):
+        # Companies whose lookup failed come due again after a backoff that
+        # grows with every consecutive failure.
+        failed_at = timezone.now()
+        for company in companies:
+            company.check_failures += 1
+            company.next_check_at = retry_check_after(failed_at, company.check_failures)
+        self.bulk_update(companies, ['check_failures', 'next_check_at'], batch_size=batch_size)
+
 
 class Company(models.Model):
     class Meta:
         verbose_name = 'Empresa'
         verbose_name_plural = 'Empresas'
+        indexes = [
+            models.Index(fields=['last_check'], name='company_last_check_idx'),
+            models.Index(fields=['status'], name='company_status_idx'),
+            models.Index(fields=['next_check_at'], name='company_next_check_idx'),
+        ]
 
     corporate_name = models.CharField(max_length=100)
     trade_name = models.CharField(max_length=100)
@@ -83,8 +223,12 @@ class Company(models.Model):
     user = models.ManyToManyField(User, blank=True)
     status = models.CharField(max_length=100, default='Ativa')
     last_check = models.DateTimeField(default=timezone.localtime)
+    next_check_at = models.DateTimeField(default=default_next_check_at)
+    check_failures = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = CompanyQuerySet.as_manager()
     
     def __str__(self):
         return self.corporate_name
@@ -94,8 +238,40 @@ class Company(models.Model):
         return self.last_check.date() <= (date.today() - relativedelta(months=1))
     
     def update_company(self, corporate_name, trade_name, status):
+        checked_at = timezone.localtime()
+        changes = CompanyChange.between(self, corporate_name, trade_name, status, checked_at)
         self.corporate_name = corporate_name
         self.trade_name = trade_name
         self.status = status
-        self.last_check = timezone.localtime()
-        self.save()
\ No newline at end of file
+        self.last_check = checked_at
+        self.next_check_at = next_check_after(self.last_check)
+        self.check_failures = 0
+        with transaction.atomic():
+            self.save()
+            CompanyChange.objects.bulk_create(changes)
+
+
+class CompanyChange(models.Model):
+    # Append-only log of field transitions, one row per changed field. The id
+    # doubles as the cursor consumers resume from.
+    TRACKED_FIELDS = ('corporate_name', 'trade_name', 'status')
+
+    class Meta:
+        verbose_name = 'Alteração de empresa'
+        verbose_name_plural = 'Alterações de empresas'
+
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='changes')
+    field = models.CharField(max_length=20, choices=[(field, field) for field in TRACKED_FIELDS])
+    old_value = models.CharField(max_length=100)
+    new_value = models.CharField(max_length=100)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def between(cls, company, corporate_name, trade_name, status, changed_at):
+        new_values = {'corporate_name': corporate_name, 'trade_name': trade_name, 'status': status}
+        return [
+            cls(company_id=company.id, field=field, old_value=getattr(company, field),
+                new_value=new_values[field], changed_at=changed_at)
+            for field in cls.TRACKED_FIELDS
+            if getattr(company, field) != new_values[field]
+        ]
\ No newline at end of file
@@ -0,0 +1,23 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class LinkHeaderCursorPagination(CursorPagination):
+    # Keyset pagination on the primary key. The body stays a plain list and the
+    # neighbouring pages are advertised in the Link header.
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = settings.API_PAGE_SIZE
+        self.max_page_size = settings.API_MAX_PAGE_SIZE
+
+    def get_paginated_response(self, data):
+        links = [
+            f'<{url}>; rel="{rel}"'
+            for rel, url in (('next', self.get_next_link()), ('prev', self.get_previous_link()))
+            if url
+        ]
+        headers = {'Link': ', '.join(links)} if links else None
+        return Response(data, headers=headers)
@@ -0,0 +1,75 @@
+import time
+
+from django.core.cache import cache
+
+from . import metrics
+from .timing import stage
+
+
+class RateLimitExceeded(Exception):
+
+    def __init__(self, wait):
+        super().__init__(f'Limite de consultas atingido, tente novamente em {wait:.0f}s')
+        self.wait = wait
+
+
+class RateLimiter:
+    # Sliding window counter kept in the Django cache: every process using the
+    # same name and cache backend shares it. A call is allowed while the calls
+    # counted in the current `period` window, plus the previous window's count
+    # weighted by how much of it still overlaps the last `period` seconds, stay
+    # within `rate`. Unlike a plain fixed window, this does not let 2 * rate
+    # calls through around a window edge.
+
+    def __init__(self, name, rate, period):
+        self.name = name
+        self.rate = rate
+        self.period = period
+
+    def _key(self, window):
+        return f'ratelimit:{self.name}:{window}'
+
+    def try_acquire(self):
+        # Returns 0 when the call may go ahead, otherwise the seconds to wait.
+        now = time.time()
+        window, offset = divmod(now, self.period)
+        window = int(window)
+        key = self._key(window)
+        cache.add(key, 0, timeout=self.period * 2)
+        try:
+            used = cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, timeout=self.period * 2)
+            used = 1
+        weighted = cache.get(self._key(window - 1), 0) * (1 - offset / self.period)
+        if weighted + used <= self.rate:
+            return 0
+        try:
+            cache.decr(key)
+        except ValueError:
+            pass
+        excess = weighted + used - self.rate
+        if excess < weighted:
+            # Enough of the previous window slides out before this one ends.
+            return excess / weighted * (self.period - offset)
+        return self.period - offset
+
+    def acquire(self, max_wait=None):
+        # Blocks until a call is allowed. With `max_wait`, raises
+        # RateLimitExceeded instead of sleeping longer than that in total, so
+        # callers such as celery tasks can retry later instead of holding a slot.
+        waited = 0
+        try:
+            with stage('rate_limit'):
+                while True:
+                    wait = self.try_acquire()
+                    if not wait:
+                        break
+                    if max_wait is not None and waited + wait > max_wait:
+                        raise RateLimitExceeded(wait)
+                    time.sleep(wait)
+                    waited += wait
+        finally:
+            if waited:
+                metrics.observe('ratelimit_wait_seconds', waited, limiter=self.name)
+        return waited
@@ -0,0 +1,116 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache as shared_cache
+from django.db import connection, transaction
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils.cache import parse_etags
+from rest_framework.response import Response
+
+from . import metrics
+from .cache import TieredCache
+from .models import Company, User
+
+
+CACHED_HEADERS = ('Link',)
+
+response_cache = TieredCache('response', maxsize=settings.RESPONSE_CACHE_MAXSIZE)
+
+
+def _version_key(scope, pk):
+    return f'response_version:{scope}:{pk}'
+
+
+def get_version(scope, pk):
+    # Versions live only in the shared cache so an invalidation is seen by every
+    # process at once; cached bodies are keyed by version and never go stale.
+    key = _version_key(scope, pk)
+    version = shared_cache.get(key)
+    if version is None:
+        shared_cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = shared_cache.get(key)
+    return version
+
+
+def _bump(scope, ids):
+    if ids:
+        shared_cache.delete_many([_version_key(scope, pk) for pk in ids])
+        metrics.incr('response_cache_invalidations', len(ids), scope=scope)
+
+
+def invalidate(user_ids=(), company_ids=()):
+    # Bump now and again once the transaction commits, so a request that read
+    # the old rows before the commit cannot keep them cached.
+    user_ids, company_ids = set(user_ids), set(company_ids)
+    _bump('user', user_ids)
+    _bump('company', company_ids)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: (_bump('user', user_ids), _bump('company', company_ids)))
+
+
+def invalidate_companies(company_ids, user_ids=()):
+    # A company listing embeds the member ids, so every member's list changes
+    # along with the company.
+    company_ids = set(company_ids)
+    if not company_ids:
+        return
+    members = Company.user.through.objects.filter(company_id__in=company_ids).values_list('user_id', flat=True)
+    invalidate(user_ids={*members, *user_ids}, company_ids=company_ids)
+
+
+def cached_response(request, view, scope, pk, build):
+    # Serves `build()` from the cache while the `scope` version of `pk` is
+    # unchanged, answering 304 when the client already holds that version.
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return build()
+    key = f'{view}:{pk}:{get_version(scope, pk)}:{request.get_full_path()}'
+    etag = '"%s"' % hashlib.md5(key.encode()).hexdigest()
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        metrics.incr('response_cache_not_modified', view=view)
+        response = Response(status=304)
+    else:
+        entry = response_cache.get(key)
+        if entry is None:
+            response = build()
+            if response.status_code != 200:
+                return response
+            headers = {name: response[name] for name in CACHED_HEADERS if response.has_header(name)}
+            response_cache.set(key, (list(response.data), headers), settings.RESPONSE_CACHE_TTL)
+        else:
+            response = Response(entry[0], headers=entry[1])
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@receiver(post_save, sender=Company)
+def invalidate_saved_company(sender, instance, **kwargs):
+    invalidate_companies([instance.pk])
+
+
+@receiver(pre_delete, sender=Company)
+def invalidate_deleted_company(sender, instance, **kwargs):
+    invalidate_companies([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user(sender, instance, created=False, **kwargs):
+    # Member listings show the user's name and email.
+    if not created:
+        invalidate(company_ids=instance.company_set.values_list('id', flat=True))
+
+
+@receiver(m2m_changed, sender=Company.user.through)
+def invalidate_memberships(sender, instance, action, reverse, pk_set, **kwargs):
+    # Removals are handled before the rows go away so the current members are
+    # still known; additions once the new rows exist.
+    if action not in ('post_add', 'pre_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_companies([instance.pk], user_ids=pk_set or ())
+    elif action == 'pre_clear':
+        invalidate_companies(instance.company_set.values_list('id', flat=True), user_ids=[instance.pk])
+    else:
+        invalidate_companies(pk_set, user_ids=[instance.pk])
@@ -1,4 +1,8 @@
+from functools import lru_cache
+
+from django.conf import settings
 from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
 
 from .models import User, Company
 
@@ -14,7 +18,9 @@ class UserSerializer(serializers.ModelSerializer):
         last_name = validated_data['last_name']
         email = validated_data['email']
         password = validated_data['password']
-        user = User.objects.create_user(first_name, last_name, email, password)
+        user = User.objects.create_user(
+            first_name, last_name, email, password, defer_hashing=settings.PASSWORD_SIGNUP_DEFERRED_HASHING
+        )
         return user
     
     def update(self, instance, validated_data):
@@ -30,7 +36,85 @@ class UserSerializer(serializers.ModelSerializer):
         return instance
 
 
+class CompanyListSerializer(serializers.ListSerializer):
+    # Same validation as ListSerializer, but it remembers which items were valid
+    # so bulk registration can insert them even when other items fail.
+    def to_internal_value(self, data):
+        self.valid_items = []
+        if not isinstance(data, list):
+            return super().to_internal_value(data)
+        errors = []
+        for index, item in enumerate(data):
+            try:
+                validated = self.child.run_validation(item)
+            except ValidationError as exc:
+                errors.append(exc.detail)
+            else:
+                self.valid_items.append((index, validated))
+                errors.append({})
+        if any(errors):
+            raise ValidationError(errors)
+        return [validated for _, validated in self.valid_items]
+
+
 class CompanySerializer(serializers.ModelSerializer):
     class Meta:
         model = Company
-        fields = ('id', 'corporate_name', 'trade_name', 'cnpj', 'user')
\ No newline at end of file
+        fields = ('id', 'corporate_name', 'trade_name', 'cnpj', 'user')
+        list_serializer_class = CompanyListSerializer
+
+
+@lru_cache(maxsize=None)
+def read_layout(serializer_class):
+    # The fields a ModelSerializer outputs, split into plain columns and
+    # many-to-many fields, computed once per serializer class.
+    model = serializer_class.Meta.model
+    fields = tuple(name for name, field in serializer_class().fields.items() if not field.write_only)
+    related = tuple(name for name in fields if model._meta.get_field(name).many_to_many)
+    columns = tuple(name for name in fields if name not in related)
+    return fields, columns, related
+
+
+class ValuesListSerializer:
+    # Read-only, many=True counterpart of `serializer_class` for list actions.
+    # Rows come from values() and are only reshaped, so no model instance or
+    # per-field to_representation is involved; each many-to-many field is
+    # filled for the whole page with one query on its through table.
+    serializer_class = None
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @classmethod
+    def values(cls, queryset):
+        _, columns, _ = read_layout(cls.serializer_class)
+        return queryset.values(*columns)
+
+    @property
+    def data(self):
+        fields, columns, related = read_layout(self.serializer_class)
+        if not related:
+            return list(self.rows)
+        ids = [row['id'] for row in self.rows]
+        lookups = {name: self.related_ids(name, ids) for name in related}
+        return [
+            {name: lookups[name].get(row['id'], []) if name in lookups else row[name] for name in fields}
+            for row in self.rows
+        ]
+
+    def related_ids(self, name, ids):
+        field = self.serializer_class.Meta.model._meta.get_field(name)
+        source, target = f'{field.m2m_field_name()}_id', f'{field.m2m_reverse_field_name()}_id'
+        pairs = field.remote_field.through.objects.filter(**{f'{source}__in': ids}).order_by(source, target)
+        grouped = {}
+        for pk, related_pk in pairs.values_list(source, target):
+            grouped.setdefault(pk, []).append(related_pk)
+        return grouped
+
+
+class UserValuesSerializer(ValuesListSerializer):
+    serializer_class = UserSerializer
+
+
+class CompanyValuesSerializer(ValuesListSerializer):
+    serializer_class = CompanySerializer
@@ -0,0 +1,36 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+def iter_ndjson(rows, chunk_size=100):
+    # Encodes dicts as newline delimited JSON, a few rows per chunk so large
+    # exports reach the client without being built in memory.
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    lines = []
+    for row in rows:
+        lines.append(encoder.encode(row))
+        if len(lines) == chunk_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+class _Echo:
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows, fields, chunk_size=100):
+    # Same as iter_ndjson for CSV, with a header line first.
+    writer = csv.writer(_Echo())
+    lines = [writer.writerow(fields)]
+    for row in rows:
+        lines.append(writer.writerow([row[field] for field in fields]))
+        if len(lines) == chunk_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
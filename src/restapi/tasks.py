@@ -1,18 +1,248 @@
-from celery import shared_task
-from .models import Company
+import time
+from collections import Counter
+from datetime import timedelta
+
+from celery import chord, shared_task
+from celery.signals import before_task_publish, task_postrun
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import metrics, timing
+from .bulk import chunked
+from .hashers import TransitionalPasswordHasher, wrap
+from .models import Company, User
+from .ratelimit import RateLimitExceeded
 from .views import get_company_data_from_external_api
 
 
+logger = get_task_logger(__name__)
+
+MAINTENANCE_COUNTS = ('scanned', 'refreshed', 'changed', 'failed', 'skipped')
+MAINTENANCE_TASKS = ('process_due_companies', 'periodic_companies_maintenance', 'refresh_companies_batch')
+
+
+@before_task_publish.connect
+def stamp_enqueued_at(headers=None, **kwargs):
+    # Lets the worker tell how long a task sat in the queue.
+    if headers is not None:
+        headers.setdefault('enqueued_at', time.time())
+
+
+@task_postrun.connect
+def publish_metrics(**kwargs):
+    # Worker metrics (receitaws latency, rate limit waits, maintenance runs)
+    # reach /api/metrics/ through the shared cache; publish them as soon as a
+    # task ends instead of waiting for the next observation.
+    metrics.publish()
+
+
+def queue_wait(task):
+    enqueued_at = getattr(task.request, 'enqueued_at', None)
+    return max(0.0, time.time() - enqueued_at) if enqueued_at else None
+
+
+def report_maintenance(task, counts, record, **extra):
+    # Emits one maintenance run as metrics and a log line, and keeps it in the
+    # shared cache so the web processes can expose the last run of each task.
+    task_name = task.name.rsplit('.', 1)[-1]
+    summary = {name: counts[name] for name in MAINTENANCE_COUNTS}
+    summary.update({
+        'seconds': round(record.elapsed(), 3),
+        'db_queries': record.queries,
+        **{f'{name}_seconds': round(seconds, 3) for name, seconds in sorted(record.stages.items())},
+        **extra,
+    })
+    wait = queue_wait(task)
+    if wait is not None:
+        summary['queue_wait_seconds'] = round(wait, 3)
+        metrics.observe('celery_queue_wait_seconds', wait, task=task_name)
+
+    for name in MAINTENANCE_COUNTS:
+        metrics.incr(f'maintenance_companies_{name}', counts[name], task=task_name)
+    for name, seconds in record.stages.items():
+        metrics.incr(f'maintenance_{name}_seconds_sum', seconds, task=task_name)
+    metrics.observe('maintenance_run_seconds', record.elapsed(), task=task_name)
+    cache.set(f'maintenance:last_run:{task_name}', {**summary, 'finished_at': timezone.now().timestamp()}, timeout=None)
+    logger.info('%s finished %s', task_name, ' '.join(f'{key}={value}' for key, value in summary.items()))
+    return summary
+
+
+def collect_maintenance_runs():
+    for name in MAINTENANCE_TASKS:
+        summary = cache.get(f'maintenance:last_run:{name}')
+        for key, value in (summary or {}).items():
+            yield f'maintenance_last_run_{key}', {'task': name}, value
+
+
+def refresh(company, counts):
+    infos = get_company_data_from_external_api(company.cnpj)
+    counts['refreshed'] += 1
+    return company, infos['nome'], infos['fantasia'], infos['situacao']
+
+
+def apply_refresh(refreshed, counts):
+    with timing.stage('apply'):
+        counts['changed'] += len(Company.objects.apply_refresh(refreshed))
+
+
+@shared_task(bind=True)
+def process_due_companies(self):
+    # Refreshes one slice of the companies whose next_check_at has passed.
+    # Results are written every COMPANIES_MAINTENANCE_CHECKPOINT_SIZE companies,
+    # so a run that dies only leaves its unfinished companies leased until
+    # COMPANIES_MAINTENANCE_LEASE expires, and the next run picks them up. When
+    # the receitaws quota runs out the rest of the slice is handed back for
+    # when it frees up, instead of holding the worker.
+    lease = timedelta(seconds=settings.COMPANIES_MAINTENANCE_LEASE)
+    updated_ids = []
+    failed = []
+    counts = Counter()
+    with timing.track() as record:
+        companies = list(Company.objects.claim_due(settings.COMPANIES_MAINTENANCE_SLICE_SIZE, lease).order_by('id'))
+        counts['scanned'] = len(companies)
+        pending = []
+        rate_limited = None
+        for batch in chunked(companies, settings.COMPANIES_MAINTENANCE_CHECKPOINT_SIZE):
+            if rate_limited is not None:
+                pending.extend(batch)
+                continue
+            refreshed = []
+            retry = []
+            for index, company in enumerate(batch):
+                try:
+                    refreshed.append(refresh(company, counts))
+                except RateLimitExceeded as e:
+                    rate_limited = e
+                    pending.extend(batch[index:])
+                    break
+                except Exception as e:
+                    counts['failed'] += 1
+                    retry.append(company)
+                    failed.append({'id': company.id, 'error': str(e)})
+                else:
+                    updated_ids.append(company.id)
+            apply_refresh(refreshed, counts)
+            Company.objects.defer_failed(retry)
+        if rate_limited is not None:
+            counts['skipped'] += len(pending)
+            available_at = timezone.now() + timedelta(seconds=rate_limited.wait)
+            Company.objects.filter(id__in=[company.id for company in pending]).update(next_check_at=available_at)
+        backlog = Company.objects.due().count()
+        report_maintenance(self, counts, record, backlog=backlog)
+    return {'updated': updated_ids, 'failed': failed, 'backlog': backlog}
+
+
+@shared_task(bind=True)
+def periodic_companies_maintenance(self):
+    if settings.COMPANIES_MAINTENANCE_FANOUT:
+        return dispatch_companies_maintenance()
+    companies = Company.objects.necessary_to_check()
+    updated_ids = []
+    counts = Counter()
+    rate_limited = None
+    with timing.track() as record:
+        try:
+            for batch in companies.in_batches(settings.COMPANIES_MAINTENANCE_BATCH_SIZE):
+                counts['scanned'] += len(batch)
+                refreshed = []
+                try:
+                    for company in batch:
+                        refreshed.append(refresh(company, counts))
+                        updated_ids.append(company.id)
+                except RateLimitExceeded:
+                    counts['skipped'] += len(batch) - len(refreshed)
+                    raise
+                except Exception:
+                    counts['failed'] += 1
+                    counts['skipped'] += len(batch) - len(refreshed) - 1
+                    raise
+                finally:
+                    apply_refresh(refreshed, counts)
+            return updated_ids
+        except RateLimitExceeded as e:
+            rate_limited = e
+        except Exception as e:
+            logger.exception('periodic_companies_maintenance stopped')
+            return {'error': str(e)}
+        finally:
+            report_maintenance(self, counts, record)
+    # Refreshed companies are no longer stale, so the retry resumes the sweep.
+    raise self.retry(exc=rate_limited, countdown=rate_limited.wait, max_retries=None)
+
+
+def dispatch_companies_maintenance():
+    companies = Company.objects.necessary_to_check().only('id')
+    batches = [
+        [company.id for company in batch]
+        for batch in companies.in_batches(settings.COMPANIES_MAINTENANCE_BATCH_SIZE)
+    ]
+    if not batches:
+        return {'batches': 0}
+    header = [refresh_companies_batch.s(company_ids) for company_ids in batches]
+    result = chord(header)(collect_companies_maintenance.s())
+    return {'batches': len(batches), 'result_id': result.id}
+
+
+@shared_task(bind=True)
+def refresh_companies_batch(self, company_ids, updated=(), failed=()):
+    # On a rate limit the task retries itself for the companies it did not get
+    # to, carrying the results so far, so the chord still sees the whole batch.
+    refreshed = []
+    updated_ids = list(updated)
+    failed = list(failed)
+    remaining = []
+    counts = Counter()
+    rate_limited = None
+    with timing.track() as record:
+        companies = list(Company.objects.filter(id__in=company_ids).order_by('id'))
+        counts['scanned'] = len(companies)
+        counts['skipped'] = len(company_ids) - len(companies)
+        for index, company in enumerate(companies):
+            try:
+                refreshed.append(refresh(company, counts))
+            except RateLimitExceeded as e:
+                rate_limited = e
+                remaining = [item.id for item in companies[index:]]
+                counts['skipped'] += len(remaining)
+                break
+            except Exception as e:
+                counts['failed'] += 1
+                failed.append({'id': company.id, 'error': str(e)})
+            else:
+                updated_ids.append(company.id)
+        apply_refresh(refreshed, counts)
+        report_maintenance(self, counts, record)
+    if rate_limited is not None:
+        raise self.retry(
+            args=[remaining], kwargs={'updated': updated_ids, 'failed': failed},
+            exc=rate_limited, countdown=rate_limited.wait, max_retries=None,
+        )
+    return {'updated': updated_ids, 'failed': failed}
+
+
 @shared_task
-def periodic_companies_maintenance():
-    companies = [obj for obj in Company.objects.all() if obj.is_necessary_to_check]
+def collect_companies_maintenance(results):
     updated_ids = []
-    try:
-        for company in companies:
-            infos = get_company_data_from_external_api(company.cnpj)
-            company.update_company(infos['nome'], infos['fantasia'], infos['situacao'])
-            updated_ids.append(company.id)
-        return updated_ids
-    except Exception as e:
-        return {'error': str(e)}
+    failed = []
+    for result in results:
+        updated_ids.extend(result['updated'])
+        failed.extend(result['failed'])
+    logger.info('companies maintenance finished batches=%d updated=%d failed=%d', len(results), len(updated_ids), len(failed))
+    return {'updated': updated_ids, 'failed': failed}
+
+
+@shared_task
+def upgrade_password_hashes(user_ids=None):
+    # Wraps the transitional hashes of deferred signups with the preferred
+    # hasher; without ids it sweeps every user still on one.
+    users = User.objects.filter(password__startswith=f'{TransitionalPasswordHasher.algorithm}$')
+    if user_ids is not None:
+        users = users.filter(id__in=user_ids)
+    upgraded = 0
+    for user_id, encoded in users.values_list('id', 'password').iterator():
+        upgraded += User.objects.filter(id=user_id, password=encoded).update(password=wrap(encoded))
+    metrics.incr('password_hashes_wrapped', upgraded)
+    return upgraded
 
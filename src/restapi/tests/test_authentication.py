@@ -0,0 +1,69 @@
+from django.core.cache import cache
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from ..authentication import CachedTokenAuthentication, token_cache
+from ..models import User, Company
+
+
+class CachedTokenAuthenticationTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            first_name='token',
+            last_name='user',
+            email='token-user@hotmail.com',
+            password='123456'
+        )
+        cls.company = Company.objects.create(corporate_name='company', trade_name='trade', cnpj='12345678901234')
+        cls.company.user.add(cls.user)
+        cls.members_url = reverse('company-members', args=[cls.company.id])
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear_local()
+        self.token, _ = Token.objects.get_or_create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    @override_settings(RESPONSE_CACHE_ENABLED=False)
+    def test_authenticated_requests_skip_token_query_once_cached(self):
+        with self.assertNumQueries(2):
+            self.client.get(self.members_url)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.members_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_cached_credentials_are_fresh_instances_without_the_password(self):
+        authentication = CachedTokenAuthentication()
+        authentication.authenticate_credentials(self.token.key)
+        user, token = authentication.authenticate_credentials(self.token.key)
+        again, _ = authentication.authenticate_credentials(self.token.key)
+        self.assertIsNot(user, again)
+        self.assertEqual((user.pk, user.email, token.key, token.user_id), (self.user.pk, self.user.email, self.token.key, self.user.pk))
+        self.assertIn('password', user.get_deferred_fields())
+        self.assertNotIn(self.user.password, repr(token_cache.get(self.token.key)))
+
+    def test_deactivating_user_invalidates_cached_token(self):
+        self.client.get(self.members_url)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(self.members_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_logout_deletes_token_and_invalidates_cache(self):
+        self.client.get(self.members_url)
+        response = self.client.post(reverse('api_logout'))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+        response = self.client.get(self.members_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_rotated_token_stops_authenticating(self):
+        self.client.get(self.members_url)
+        self.token.delete()
+        Token.objects.create(user=self.user)
+        response = self.client.get(self.members_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,41 @@
+import random
+
+from django.test import TestCase
+
+from benchmarks import hashers, serializers
+from benchmarks.suite import SHADOWED_ROUTES, compare, route_names, run_suite, seed
+
+
+class BenchmarkSuiteTestCase(TestCase):
+    def test_run_suite_covers_every_route_and_maintenance(self):
+        report = run_suite(40, iterations=2, warmup=0, stale=3, bulk_size=2)
+        routes = {name.split(':')[0] for name in report['routes']}
+        self.assertEqual(routes, route_names() - SHADOWED_ROUTES)
+        for name, result in report['routes'].items():
+            self.assertEqual(set(result['statuses']) & {'400', '401', '403', '404', '500'}, set(), name)
+        self.assertEqual(report['maintenance']['companies'], 3)
+        self.assertEqual(report['meta']['users'], 40)
+
+    def test_compare_reports_slower_routes_and_extra_queries(self):
+        baseline = {'routes': {'api-root': {'p95_ms': 10, 'queries_max': 1}}, 'maintenance': {'queries': 6}}
+        report = {'routes': {'api-root': {'p95_ms': 11, 'queries_max': 2}}, 'maintenance': {'queries': 6}}
+        self.assertEqual(
+            [(item['route'], item['metric']) for item in compare(baseline, report, tolerance=0.2)],
+            [('api-root', 'queries_max')],
+        )
+
+    def test_serializer_benchmark_compares_both_paths(self):
+        seed(40, random.Random(0), stale=0)
+        report = serializers.run(4, repeat=1)
+        for name in ('companies', 'users'):
+            self.assertEqual(report[name]['model_serializer']['rows'], 4)
+            self.assertEqual(report[name]['values_serializer']['rows'], 4)
+            self.assertGreater(report[name]['speedup']['encode_rows_per_second'], 0)
+
+    def test_hasher_benchmark_reports_rates(self):
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            report = hashers.run(seconds=0.01)
+        self.assertGreater(report['pbkdf2']['logins_per_second'], 0)
+        self.assertGreater(report['transitional']['signups_per_second'], 0)
+        self.assertGreater(report['wrapped']['wraps_per_second'], 0)
+
@@ -0,0 +1,42 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from ..cache import LocalCache, TieredCache
+
+
+class LocalCacheTestCase(SimpleTestCase):
+    def test_get_evicts_least_recently_used_entries(self):
+        local = LocalCache(maxsize=2)
+        local.set('a', 1, expires_at=float('inf'))
+        local.set('b', 2, expires_at=float('inf'))
+        local.get('a')
+        local.set('c', 3, expires_at=float('inf'))
+        self.assertIsNone(local.get('b'))
+        self.assertEqual(local.get('a')[1], 1)
+
+    def test_get_drops_expired_entries(self):
+        local = LocalCache(maxsize=2)
+        local.set('a', 1, expires_at=0)
+        self.assertIsNone(local.get('a'))
+
+
+class TieredCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_get_promotes_shared_entries_to_local_tier(self):
+        TieredCache('tiered').set('key', 'value', ttl=60)
+        other_process = TieredCache('tiered')
+        self.assertEqual(other_process.get('key'), 'value')
+        with patch('restapi.cache.shared_cache') as shared_cache:
+            self.assertEqual(other_process.get('key'), 'value')
+        shared_cache.get.assert_not_called()
+
+    def test_delete_removes_entry_from_both_tiers(self):
+        tiered = TieredCache('tiered')
+        tiered.set('key', 'value', ttl=60)
+        tiered.delete('key')
+        self.assertIsNone(tiered.get('key'))
+        self.assertIsNone(TieredCache('tiered').get('key'))
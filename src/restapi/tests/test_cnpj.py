@@ -0,0 +1,163 @@
+import asyncio
+from unittest.mock import Mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from benchmarks.stub import StubCNPJServer, company_payload
+
+from .. import metrics
+from ..cnpj import AsyncCNPJClient, CNPJClient, CNPJLookupError, async_cnpj_client, cnpj_cache, get_many_company_data
+
+
+class CNPJTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        cnpj_cache.clear_local()
+
+
+@override_settings(CNPJ_API_RATE_LIMIT=1000)
+class CNPJClientTestCase(CNPJTestCase):
+    def test_get_company_data_returns_parsed_company(self):
+        with StubCNPJServer({'12345678901234': company_payload('EC LTDA', 'EC')}) as stub:
+            data = CNPJClient(base_url=stub.url).get_company_data('12345678901234')
+        self.assertEqual(data, {'nome': 'EC LTDA', 'fantasia': 'EC', 'situacao': 'ATIVA'})
+
+    def test_lookup_records_api_latency_histogram(self):
+        metrics.reset()
+        with StubCNPJServer({'12345678901234': company_payload('EC LTDA')}) as stub:
+            CNPJClient(base_url=stub.url).get_company_data('12345678901234')
+        self.assertEqual(metrics.get_histogram_count('cnpj_api_seconds', status=200), 1)
+        buckets = [entry for entry in metrics.process_snapshot() if entry['name'] == 'cnpj_api_seconds_bucket']
+        self.assertEqual(buckets[-1], {'name': 'cnpj_api_seconds_bucket', 'labels': {'status': 200, 'le': '+Inf'}, 'value': 1})
+
+    def test_get_company_data_raises_when_api_returns_error(self):
+        with StubCNPJServer() as stub:
+            with self.assertRaises(CNPJLookupError):
+                CNPJClient(base_url=stub.url).get_company_data('12345678901234')
+
+    def test_lookup_retries_throttled_responses(self):
+        companies = {'12345678901234': company_payload('EC LTDA')}
+        with StubCNPJServer(companies, failures={'12345678901234': [429, 503]}) as stub:
+            data = CNPJClient(base_url=stub.url, backoff_factor=0).get_company_data('12345678901234')
+        self.assertEqual(data['nome'], 'EC LTDA')
+        self.assertEqual(len(stub.requests), 3)
+
+    def test_every_attempt_takes_a_rate_limit_token(self):
+        limiter = Mock()
+        companies = {'12345678901234': company_payload('EC LTDA')}
+        with StubCNPJServer(companies, failures={'12345678901234': [429, 503]}) as stub:
+            CNPJClient(base_url=stub.url, backoff_factor=0, rate_limiter=limiter).get_company_data('12345678901234')
+        self.assertEqual(limiter.acquire.call_count, 3)
+
+    def test_session_reuses_pooled_connection(self):
+        companies = {'12345678901234': company_payload('EC LTDA'), '11111111111111': company_payload('ONE LTDA')}
+        with StubCNPJServer(companies) as stub:
+            client = CNPJClient(base_url=stub.url)
+            client.get_company_data('12345678901234')
+            client.get_company_data('11111111111111')
+            pool = client.session.get_adapter(stub.url).poolmanager.connection_from_url(stub.url)
+        self.assertEqual(pool.num_connections, 1)
+
+    def test_get_company_data_serves_repeated_lookups_from_cache(self):
+        with StubCNPJServer({'12345678901234': company_payload('EC LTDA')}) as stub:
+            client = CNPJClient(base_url=stub.url)
+            client.get_company_data('12345678901234')
+            data = client.get_company_data('12345678901234')
+        self.assertEqual(data['nome'], 'EC LTDA')
+        self.assertEqual(stub.requests, ['12345678901234'])
+
+    def test_get_company_data_uses_shared_cache_when_local_tier_is_empty(self):
+        with StubCNPJServer({'12345678901234': company_payload('EC LTDA')}) as stub:
+            CNPJClient(base_url=stub.url).get_company_data('12345678901234')
+            cnpj_cache.clear_local()
+            hits_before = metrics.get('cache_hits', cache='cnpj', tier='shared')
+            CNPJClient(base_url=stub.url).get_company_data('12345678901234')
+        self.assertEqual(len(stub.requests), 1)
+        self.assertEqual(metrics.get('cache_hits', cache='cnpj', tier='shared'), hits_before + 1)
+
+    @override_settings(CNPJ_CACHE_ERROR_TTL=0)
+    def test_error_responses_use_the_error_ttl(self):
+        with StubCNPJServer() as stub:
+            client = CNPJClient(base_url=stub.url)
+            for _ in range(2):
+                with self.assertRaises(CNPJLookupError):
+                    client.get_company_data('12345678901234')
+        self.assertEqual(len(stub.requests), 2)
+
+    def test_error_responses_are_cached(self):
+        with StubCNPJServer() as stub:
+            client = CNPJClient(base_url=stub.url)
+            for _ in range(2):
+                with self.assertRaises(CNPJLookupError):
+                    client.get_company_data('12345678901234')
+        self.assertEqual(len(stub.requests), 1)
+
+    def test_throttled_responses_are_not_cached(self):
+        companies = {'12345678901234': company_payload('EC LTDA')}
+        with StubCNPJServer(companies, failures={'12345678901234': [429, 429]}) as stub:
+            client = CNPJClient(base_url=stub.url, retries=1, backoff_factor=0)
+            with self.assertRaises(Exception):
+                client.get_company_data('12345678901234')
+            data = client.get_company_data('12345678901234')
+        self.assertEqual(data['nome'], 'EC LTDA')
+
+
+@override_settings(CNPJ_API_RATE_LIMIT=1000)
+class AsyncCNPJClientTestCase(CNPJTestCase):
+    def test_get_many_company_data_resolves_every_cnpj(self):
+        companies = {f'1234567890123{index}': company_payload(f'C{index} LTDA') for index in range(5)}
+        with StubCNPJServer(companies) as stub:
+            async def resolve():
+                async with AsyncCNPJClient(base_url=stub.url, concurrency=2) as client:
+                    return await client.get_many_company_data(list(companies) + ['99999999999999'])
+
+            results = asyncio.run(resolve())
+        self.assertEqual(results['12345678901230']['nome'], 'C0 LTDA')
+        self.assertIsInstance(results['99999999999999'], CNPJLookupError)
+        self.assertEqual(len(results), 6)
+
+    def test_lookup_retries_server_errors(self):
+        companies = {'12345678901234': company_payload('EC LTDA')}
+        with StubCNPJServer(companies, failures={'12345678901234': [502]}) as stub:
+            async def resolve():
+                async with AsyncCNPJClient(base_url=stub.url, backoff_factor=0) as client:
+                    return await client.get_company_data('12345678901234')
+
+            data = asyncio.run(resolve())
+        self.assertEqual(data['nome'], 'EC LTDA')
+
+    def test_every_attempt_takes_a_rate_limit_token(self):
+        limiter = Mock(**{'try_acquire.return_value': 0})
+        companies = {'12345678901234': company_payload('EC LTDA')}
+        with StubCNPJServer(companies, failures={'12345678901234': [429, 502]}) as stub:
+            async def resolve():
+                async with AsyncCNPJClient(base_url=stub.url, backoff_factor=0, rate_limiter=limiter) as client:
+                    return await client.get_company_data('12345678901234')
+
+            asyncio.run(resolve())
+        self.assertEqual(limiter.try_acquire.call_count, 3)
+
+    def test_get_many_company_data_uses_configured_api(self):
+        with StubCNPJServer({'12345678901234': company_payload('EC LTDA')}) as stub:
+            with override_settings(CNPJ_API_URL=stub.url):
+                results = get_many_company_data(['12345678901234'])
+        self.assertEqual(results['12345678901234']['nome'], 'EC LTDA')
+
+    def test_async_cnpj_client_is_closed_after_each_call_under_wsgi(self):
+        async def open_client():
+            async with async_cnpj_client() as client:
+                return client
+
+        client = asyncio.run(open_client())
+        self.assertTrue(client.client.is_closed)
+
+    @override_settings(ASGI=True)
+    def test_async_cnpj_client_is_shared_by_the_event_loop_under_asgi(self):
+        async def open_clients():
+            async with async_cnpj_client() as first, async_cnpj_client() as second:
+                return first, second
+
+        first, second = asyncio.run(open_clients())
+        self.assertIs(first, second)
+        self.assertFalse(first.client.is_closed)
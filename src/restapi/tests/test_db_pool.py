@@ -0,0 +1,80 @@
+import os
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+from psycopg2 import OperationalError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+from saas.config import get_postgres_configs
+from saas.db.pool import ConnectionPool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.rolled_back = False
+        self.info = SimpleNamespace(transaction_status=TRANSACTION_STATUS_IDLE)
+
+    def rollback(self):
+        self.rolled_back = True
+        self.info.transaction_status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    def test_checkin_makes_connection_reusable(self):
+        pool = ConnectionPool(max_size=2, timeout=1, max_idle=60)
+        connection = pool.checkout(FakeConnection)
+        pool.checkin(connection)
+        self.assertIs(pool.checkout(FakeConnection), connection)
+        self.assertEqual(pool.stats()['open_connections'], 1)
+        self.assertEqual(pool.stats()['checkouts'], 2)
+
+    def test_checkin_rolls_back_open_transaction(self):
+        pool = ConnectionPool(max_size=1, timeout=1, max_idle=60)
+        connection = pool.checkout(FakeConnection)
+        connection.info.transaction_status = TRANSACTION_STATUS_INTRANS
+        pool.checkin(connection)
+        self.assertTrue(connection.rolled_back)
+
+    def test_checkout_times_out_when_pool_is_exhausted(self):
+        pool = ConnectionPool(max_size=1, timeout=0.01, max_idle=60)
+        pool.checkout(FakeConnection)
+        with self.assertRaises(OperationalError):
+            pool.checkout(FakeConnection)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+    def test_checkout_waits_for_a_released_connection(self):
+        pool = ConnectionPool(max_size=1, timeout=5, max_idle=60)
+        connection = pool.checkout(FakeConnection)
+        threading.Timer(0.05, pool.checkin, args=[connection]).start()
+        self.assertIs(pool.checkout(FakeConnection), connection)
+        self.assertGreater(pool.stats()['wait_seconds'], 0)
+
+    def test_checkout_discards_closed_and_stale_connections(self):
+        pool = ConnectionPool(max_size=2, timeout=1, max_idle=0)
+        connection = pool.checkout(FakeConnection)
+        pool.checkin(connection)
+        replacement = pool.checkout(FakeConnection)
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['open_connections'], 1)
+
+
+class PostgresConfigTestCase(SimpleTestCase):
+    def test_persistent_connections_by_default(self):
+        with patch.dict(os.environ, clear=True):
+            config = get_postgres_configs()['default']
+        self.assertEqual(config['CONN_MAX_AGE'], 60)
+        self.assertTrue(config['CONN_HEALTH_CHECKS'])
+        self.assertNotIn('POOL', config)
+
+    def test_pooled_mode_returns_connections_after_each_request(self):
+        with patch.dict(os.environ, {'DB_POOL': 'true', 'DB_POOL_MAX_SIZE': '4'}):
+            config = get_postgres_configs()['default']
+        self.assertEqual(config['CONN_MAX_AGE'], 0)
+        self.assertEqual(config['POOL']['MAX_SIZE'], 4)
@@ -0,0 +1,85 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from ..exports import COMPANY_FIELDS, company_rows, member_rows
+from ..imports import read_rows
+from ..models import User, Company
+
+
+class ExportTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(first_name='export', last_name='user', email='export@hotmail.com', password='123456')
+        cls.other_user = User.objects.create_user(first_name='other', last_name='user', email='other@hotmail.com', password='123456')
+        cls.company = Company.objects.create(corporate_name='FIRST LTDA', trade_name='FIRST', cnpj='12345678901234')
+        cls.company.user.add(cls.user, cls.other_user)
+        cls.other = Company.objects.create(corporate_name='OTHER LTDA', trade_name='OTHER', cnpj='11111111111111')
+        cls.other.user.add(cls.other_user)
+        cls.admin = User.objects.create_superuser('admin', 'user', 'export-admin@hotmail.com', '123456')
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.user)
+
+    def read(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_company_rows_are_plain_dicts(self):
+        rows = list(company_rows(user=self.user))
+        self.assertEqual(rows, [{
+            'id': self.company.id, 'corporate_name': 'FIRST LTDA', 'trade_name': 'FIRST',
+            'cnpj': '12345678901234', 'status': 'Ativa',
+        }])
+        self.assertEqual(len(list(company_rows())), 2)
+
+    def test_member_rows_by_company(self):
+        rows = list(member_rows([self.company.id, self.other.id]))
+        self.assertEqual(
+            [(row['company_id'], row['email']) for row in rows],
+            [(self.company.id, 'export@hotmail.com'), (self.company.id, 'other@hotmail.com'), (self.other.id, 'other@hotmail.com')]
+        )
+        with self.assertNumQueries(1):
+            list(member_rows(user=self.user))
+
+    def test_export_companies_as_ndjson(self):
+        response, content = self.read(reverse('company-export'))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['cnpj'] for line in content.splitlines()], ['12345678901234'])
+
+    def test_export_companies_as_csv_for_admin(self):
+        self.client.force_authenticate(user=self.admin)
+        response, content = self.read(reverse('company-export'), output='csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="companies.csv"')
+        rows = list(read_rows(StringIO(content), 'csv'))
+        self.assertEqual([row['cnpj'] for row in rows], ['12345678901234', '11111111111111'])
+        self.assertEqual(tuple(rows[0]), COMPANY_FIELDS)
+
+    def test_export_members_is_limited_to_member_companies(self):
+        url = reverse('company-members-export')
+        _, content = self.read(url, company_id=f'{self.company.id},{self.other.id}')
+        self.assertEqual({json.loads(line)['company_id'] for line in content.splitlines()}, {self.company.id})
+
+    def test_export_rejects_invalid_parameters(self):
+        self.assertEqual(self.client.get(reverse('company-export'), {'output': 'xml'}).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('company-members-export'), {'company_id': 'a,b'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_data_command(self):
+        out = StringIO()
+        call_command('export_data', 'members', '--company', str(self.other.id), stdout=out)
+        self.assertEqual([json.loads(line)['user_id'] for line in out.getvalue().splitlines()], [self.other_user.id])
+
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        call_command('export_data', 'companies', '--path', path, '--user', str(self.other_user.id), stdout=StringIO())
+        with open(path, encoding='utf-8', newline='') as stream:
+            self.assertEqual(len(list(read_rows(stream, 'csv'))), 2)
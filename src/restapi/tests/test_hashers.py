@@ -0,0 +1,99 @@
+from unittest.mock import patch
+
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from ..hashers import rehash_in_background, wrap
+from ..models import User
+from ..tasks import upgrade_password_hashes
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=2000, PASSWORD_REHASH_WORKERS=0)
+class HashersTestCase(TestCase):
+
+    def test_tuned_pbkdf2_follows_settings(self):
+        encoded = make_password('secret123')
+        self.assertTrue(encoded.startswith('pbkdf2_sha256$2000$'))
+        self.assertFalse(get_hasher().must_update(encoded))
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=3000):
+            self.assertTrue(get_hasher().must_update(encoded))
+
+    def test_wrapped_transitional_hash_verifies_the_raw_password(self):
+        transitional = make_password('secret123', hasher='pbkdf2_transitional')
+        wrapped = wrap(transitional)
+        self.assertTrue(wrapped.startswith('wrapped$1000$pbkdf2_sha256$2000$'))
+        self.assertLessEqual(len(wrapped), User._meta.get_field('password').max_length)
+        self.assertTrue(check_password('secret123', wrapped))
+        self.assertFalse(check_password('wrong', wrapped))
+        self.assertEqual(identify_hasher(wrapped).safe_summary(wrapped)['algorithm'], 'wrapped pbkdf2_sha256')
+
+    def test_rehash_keeps_a_password_changed_meanwhile(self):
+        user = User.objects.create_user('hash', 'user', 'rehash@hotmail.com', 'secret123')
+        stale = user.password
+        user.set_password('changed123')
+        user.save()
+        rehash_in_background(user, stale, 'secret123')
+        user.refresh_from_db()
+        self.assertTrue(user.check_password('changed123'))
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=2000, PASSWORD_REHASH_WORKERS=0)
+class PasswordUpgradeTestCase(APITestCase):
+
+    def login(self, email, password):
+        return self.client.post(reverse('api_login'), {'username': email, 'password': password})
+
+    @override_settings(PASSWORD_SIGNUP_DEFERRED_HASHING=True)
+    def test_deferred_signup_is_wrapped_then_upgraded_on_login(self):
+        data = {'first_name': 'new', 'last_name': 'user', 'email': 'deferred@hotmail.com', 'password': 'secret123'}
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('user-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user = User.objects.get(email='deferred@hotmail.com')
+        self.assertTrue(user.password.startswith('pbkdf2_transitional$'))
+
+        with patch.object(upgrade_password_hashes, 'delay', side_effect=upgrade_password_hashes) as delay:
+            for callback in callbacks:
+                callback()
+        delay.assert_called_once_with([user.pk])
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('wrapped$'))
+
+        self.assertEqual(self.login('deferred@hotmail.com', 'secret123').status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$2000$'))
+
+    @override_settings(PASSWORD_SIGNUP_DEFERRED_HASHING=True)
+    def test_deferred_signup_succeeds_when_the_broker_is_down(self):
+        data = {'first_name': 'new', 'last_name': 'user', 'email': 'brokerless@hotmail.com', 'password': 'secret123'}
+        with patch.object(upgrade_password_hashes, 'delay', side_effect=OSError('connection refused')):
+            with self.assertLogs('restapi.models', 'ERROR'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    response = self.client.post(reverse('user-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user = User.objects.get(email='brokerless@hotmail.com')
+        self.assertTrue(user.password.startswith('pbkdf2_transitional$'))
+
+        self.assertEqual(upgrade_password_hashes(), 1)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('wrapped$'))
+        self.assertTrue(user.check_password('secret123'))
+
+    def test_login_upgrades_a_stale_hash(self):
+        user = User.objects.create_user('stale', 'user', 'stale@hotmail.com', 'secret123')
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=3000):
+            self.assertEqual(self.login('stale@hotmail.com', 'secret123').status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$3000$'))
+        self.assertEqual(self.login('stale@hotmail.com', 'wrong').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upgrade_sweep_wraps_transitional_hashes(self):
+        user = User.objects.create_user('sweep', 'user', 'sweep@hotmail.com', 'secret123')
+        User.objects.filter(pk=user.pk).update(password=make_password('secret123', hasher='pbkdf2_transitional'))
+        self.assertEqual(upgrade_password_hashes(), 1)
+        self.assertEqual(upgrade_password_hashes(), 0)
+        user.refresh_from_db()
+        self.assertTrue(user.check_password('secret123'))
@@ -0,0 +1,79 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+
+from ..imports import import_users, read_rows
+from ..models import User
+
+
+class ImportUsersTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(first_name='existing', last_name='user', email='existing@hotmail.com', password='123456')
+
+    def write_file(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as stream:
+            stream.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_read_rows_parses_csv_and_ndjson(self):
+        csv_rows = list(read_rows(StringIO('first_name,last_name,email,password\na,b,a@b.com,123\n'), 'csv'))
+        ndjson_rows = list(read_rows(StringIO('{"email": "a@b.com"}\n\n{"email": "c@d.com"}\n'), 'ndjson'))
+        self.assertEqual(csv_rows[0]['email'], 'a@b.com')
+        self.assertEqual([row['email'] for row in ndjson_rows], ['a@b.com', 'c@d.com'])
+
+    def test_import_users_creates_users_with_tokens_and_hashed_passwords(self):
+        rows = [
+            {'first_name': 'new', 'last_name': str(index), 'email': f'new{index}@hotmail.com', 'password': 'secret123'}
+            for index in range(3)
+        ]
+        rows += [
+            {'first_name': 'dup', 'last_name': 'user', 'email': 'existing@hotmail.com', 'password': 'secret123'},
+            {'first_name': '', 'last_name': 'user', 'email': 'blank@hotmail.com', 'password': 'secret123'},
+        ]
+        progress = []
+        imported, skipped = import_users(rows, batch_size=2, workers=0, progress=lambda *args: progress.append(args))
+        self.assertEqual((imported, skipped), (3, 2))
+        self.assertEqual([entry[:2] for entry in progress], [(2, 0), (3, 1), (3, 2)])
+        user = User.objects.get(email='new0@hotmail.com')
+        self.assertTrue(user.check_password('secret123'))
+        self.assertTrue(Token.objects.filter(user=user).exists())
+
+    def test_import_users_skips_emails_taken_during_the_import(self):
+        rows = [
+            {'first_name': 'race', 'last_name': str(index), 'email': f'race{index}@hotmail.com', 'password': 'secret123'}
+            for index in range(3)
+        ]
+
+        def signup_meanwhile(password):
+            # A signup lands between the existing-email check and the insert.
+            if not User.objects.filter(email='race1@hotmail.com').exists():
+                User.objects.create_user(first_name='signup', last_name='user', email='race1@hotmail.com', password='123456')
+            return make_password(password)
+
+        with patch('restapi.imports.make_password', side_effect=signup_meanwhile):
+            imported, skipped = import_users(rows, batch_size=3, workers=0)
+        self.assertEqual((imported, skipped), (2, 1))
+        self.assertEqual(User.objects.get(email='race1@hotmail.com').first_name, 'signup')
+        self.assertTrue(Token.objects.filter(user__email='race2@hotmail.com').exists())
+
+    def test_import_users_command_hashes_in_process_pool(self):
+        lines = [
+            json.dumps({'first_name': 'pool', 'last_name': str(index), 'email': f'pool{index}@hotmail.com', 'password': 'secret123'})
+            for index in range(2)
+        ]
+        path = self.write_file('.ndjson', '\n'.join(lines))
+        out = StringIO()
+        call_command('import_users', path, '--workers', '2', stdout=out)
+        self.assertIn('users/s', out.getvalue())
+        self.assertIn('Done: 2 users imported, 0 skipped.', out.getvalue())
+        self.assertTrue(User.objects.get(email='pool1@hotmail.com').check_password('secret123'))
@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from ..models import User, Company
+
+
+class HotQueryIndexesTestCase(TestCase):
+    companies = 20000
+    users = 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.localtime()
+        User.objects.bulk_create([
+            User(first_name='user', last_name=str(index), email=f'user{index}@hotmail.com')
+            for index in range(cls.users)
+        ])
+        Company.objects.bulk_create([
+            Company(
+                corporate_name=f'company {index}',
+                trade_name='trade',
+                cnpj=f'{index:014d}',
+                status='Ativa' if index % 50 else 'Inativa',
+                last_check=now - timedelta(days=40 if index % 100 == 0 else index % 28),
+            )
+            for index in range(cls.companies)
+        ], batch_size=1000)
+        user_ids = list(User.objects.values_list('id', flat=True))
+        company_ids = list(Company.objects.values_list('id', flat=True))
+        through = Company.user.through
+        through.objects.bulk_create([
+            through(company_id=company_id, user_id=user_ids[index % len(user_ids)])
+            for index, company_id in enumerate(company_ids)
+        ], batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = User.objects.first()
+        cls.company = Company.objects.first()
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        # Table access lines look like "Index Scan using ..." on PostgreSQL and
+        # "SEARCH table USING INDEX ..." on SQLite; a full table scan has no index.
+        accesses = [
+            line.upper() for line in plan.splitlines()
+            if ('SCAN' in line.upper() or 'SEARCH' in line.upper()) and 'BITMAP HEAP SCAN' not in line.upper()
+        ]
+        self.assertTrue(accesses, plan)
+        for line in accesses:
+            self.assertTrue('INDEX' in line or 'PRIMARY KEY' in line, plan)
+
+    def test_stale_company_scan_uses_index(self):
+        self.assertUsesIndex(Company.objects.necessary_to_check())
+
+    def test_user_companies_uses_index(self):
+        self.assertUsesIndex(Company.objects.filter(user__id=self.user.id))
+
+    def test_company_members_uses_index(self):
+        self.assertUsesIndex(User.objects.filter(company__id=self.company.id))
+
+    def test_cnpj_lookup_uses_index(self):
+        self.assertUsesIndex(Company.objects.filter(cnpj=self.company.cnpj))
+
+    def test_status_filter_uses_index(self):
+        self.assertUsesIndex(Company.objects.filter(status='Inativa'))
@@ -0,0 +1,81 @@
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from .. import metrics
+from ..authentication import token_cache
+from ..models import User, Company
+from ..timing import Timing, sql_shape
+
+
+class RequestTimingMiddlewareTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            first_name='timing',
+            last_name='user',
+            email='timing-user@hotmail.com',
+            password='123456'
+        )
+        company = Company.objects.create(corporate_name='company', trade_name='trade', cnpj='12345678901234')
+        company.user.add(cls.user)
+        cls.token = Token.objects.get(user=cls.user)
+        cls.companies_url = reverse('user-companies')
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear_local()
+        metrics.reset()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_disabled_middleware_adds_no_header(self):
+        response = self.client.get(self.companies_url)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(REQUEST_TIMING_ENABLED=True, RESPONSE_CACHE_ENABLED=False)
+    def test_enabled_middleware_reports_stages_and_queries(self):
+        response = self.client.get(self.companies_url)
+        entries = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(entries, ['auth', 'db', 'serializer', 'queries', 'total'])
+        self.assertEqual(metrics.get('db_queries', view='user-companies'), 3)
+        self.assertEqual(metrics.get('http_requests', view='user-companies', method='GET', status=200), 1)
+
+    @override_settings(REQUEST_TIMING_ENABLED=True, REQUEST_TIMING_NPLUSONE_THRESHOLD=1)
+    def test_repeated_query_shapes_are_flagged(self):
+        with self.assertLogs('restapi.middleware', 'WARNING') as logs:
+            self.client.get(self.companies_url)
+        self.assertIn('Possible N+1 in user-companies', logs.output[0])
+        self.assertEqual(metrics.get('nplusone_detected', view='user-companies'), 1)
+
+    def test_prometheus_endpoint_requires_admin(self):
+        response = self.client.get(reverse('api_metrics_prometheus'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_prometheus_endpoint_renders_metrics(self):
+        self.user.is_admin = True
+        self.user.save()
+        metrics.incr('http_requests', view='user-companies', method='GET', status=200)
+        response = self.client.get(reverse('api_metrics_prometheus'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(
+            f'http_requests{{method="GET",process="{metrics.process_id()}",status="200",view="user-companies"}} 1.0',
+            response.content.decode().splitlines()
+        )
+
+
+class SQLShapeTestCase(SimpleTestCase):
+    def test_shapes_ignore_literals_and_in_list_length(self):
+        self.assertEqual(
+            sql_shape('SELECT * FROM t WHERE id IN (%s, %s, %s) AND x = 10'),
+            sql_shape("SELECT * FROM t WHERE id IN (%s) AND x = 'a'"),
+        )
+
+    def test_repeated_shapes_respects_threshold(self):
+        timing = Timing()
+        for _ in range(3):
+            timing.execute(lambda *args: None, 'SELECT 1 FROM t WHERE id = %s', [1], False, {})
+        timing.execute(lambda *args: None, 'SELECT 1 FROM u', [], False, {})
+        self.assertEqual(timing.repeated_shapes(3), [('SELECT ? FROM t WHERE id = %s', 3)])
@@ -1,8 +1,10 @@
 from datetime import timedelta
 
+from dateutil.relativedelta import relativedelta
 from django.utils import timezone
-from django.db import IntegrityError
-from django.test import TestCase
+from django.db import IntegrityError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from ..models import User, Company
 
 class UserModelTest(TestCase):
@@ -160,4 +162,102 @@ class CompanyModelTest(TestCase):
         self.company.last_check = timezone.localtime() - timedelta(days=32)
         self.company.save()
         companies = [company for company in Company.objects.all() if company.is_necessary_to_check]
-        self.assertEqual(len(companies), 1)
\ No newline at end of file
+        self.assertEqual(len(companies), 1)
+
+    def test_necessary_to_check_queryset_matches_property(self):
+        self.company.last_check = timezone.localtime() - timedelta(days=32)
+        self.company.save()
+        Company.objects.create(corporate_name='FRESH LTDA', trade_name='FRESH', cnpj='22222222222222')
+        companies = Company.objects.necessary_to_check()
+        expected = [company for company in Company.objects.all() if company.is_necessary_to_check]
+        self.assertEqual(list(companies), expected)
+
+    def test_in_batches_yields_every_company_in_chunks(self):
+        for index in range(4):
+            Company.objects.create(corporate_name=f'C{index}', trade_name=f'C{index}', cnpj=f'3333333333333{index}')
+        batches = list(Company.objects.all().in_batches(batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(
+            [company.id for batch in batches for company in batch],
+            list(Company.objects.order_by('id').values_list('id', flat=True))
+        )
+
+    def test_apply_refresh_writes_changed_companies_and_advances_last_check(self):
+        old_check = timezone.localtime() - timedelta(days=40)
+        unchanged = Company.objects.create(
+            corporate_name='SAME LTDA', trade_name='SAME', cnpj='44444444444444', status='Ativa', last_check=old_check
+        )
+        Company.objects.filter(id=self.company.id).update(last_check=old_check)
+        changed = Company.objects.get(id=self.company.id)
+        unchanged_updated_at = unchanged.updated_at
+
+        with CaptureQueriesContext(connection) as queries:
+            result = Company.objects.apply_refresh([
+                (changed, 'FDD LTDA', 'FDB', 'Inativo'),
+                (unchanged, 'SAME LTDA', 'SAME', 'Ativa'),
+            ])
+
+        self.assertEqual(result, [changed])
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 2)
+        changed.refresh_from_db()
+        unchanged.refresh_from_db()
+        self.assertEqual(changed.corporate_name, 'FDD LTDA')
+        self.assertEqual(changed.status, 'Inativo')
+        self.assertFalse(changed.is_necessary_to_check)
+        self.assertFalse(unchanged.is_necessary_to_check)
+        self.assertEqual(unchanged.updated_at, unchanged_updated_at)
+
+@override_settings(COMPANIES_CHECK_JITTER=60 * 60)
+class CompanySchedulingTest(TestCase):
+    def create_company(self, cnpj, next_check_at):
+        return Company.objects.create(corporate_name=cnpj, trade_name=cnpj, cnpj=cnpj, next_check_at=next_check_at)
+
+    def test_new_companies_are_scheduled_a_month_ahead_with_jitter(self):
+        company = Company.objects.create(corporate_name='new', trade_name='new', cnpj='12345678901234')
+        expected = company.last_check + relativedelta(months=1)
+        self.assertLessEqual(abs((company.next_check_at - expected).total_seconds()), 60 * 60)
+
+    def test_claim_due_leases_the_oldest_due_companies(self):
+        now = timezone.now()
+        oldest = self.create_company('11111111111111', now - timedelta(days=2))
+        older = self.create_company('22222222222222', now - timedelta(days=1))
+        self.create_company('33333333333333', now - timedelta(hours=1))
+        self.create_company('44444444444444', now + timedelta(days=1))
+        claimed = Company.objects.claim_due(2, timedelta(minutes=30))
+        self.assertEqual(sorted(claimed.values_list('id', flat=True)), [oldest.id, older.id])
+        self.assertEqual(Company.objects.due().count(), 1)
+        self.assertEqual(list(Company.objects.claim_due(2, timedelta(minutes=30)).values_list('cnpj', flat=True)), ['33333333333333'])
+
+    def test_apply_refresh_reschedules_refreshed_companies(self):
+        company = self.create_company('11111111111111', timezone.now() - timedelta(days=1))
+        Company.objects.apply_refresh([(company, company.corporate_name, company.trade_name, company.status)])
+        company.refresh_from_db()
+        self.assertGreater(company.next_check_at, timezone.now() + timedelta(days=27))
+
+    def test_apply_refresh_jitters_every_unchanged_company(self):
+        companies = [self.create_company(f'1111111111111{index}', timezone.now()) for index in range(3)]
+        Company.objects.apply_refresh([(company, company.corporate_name, company.trade_name, company.status) for company in companies])
+        self.assertEqual(len(set(Company.objects.values_list('next_check_at', flat=True))), 3)
+
+    @override_settings(COMPANIES_CHECK_RETRY_DELAY=60 * 60, COMPANIES_CHECK_RETRY_MAX_DELAY=3 * 60 * 60)
+    def test_failed_companies_back_off_until_refreshed(self):
+        company = self.create_company('11111111111111', timezone.now())
+        delays = []
+        for _ in range(4):
+            Company.objects.defer_failed([company])
+            company.refresh_from_db()
+            delays.append(round((company.next_check_at - timezone.now()).total_seconds() / 3600))
+        self.assertEqual(delays, [1, 2, 3, 3])
+        self.assertEqual(company.check_failures, 4)
+        Company.objects.apply_refresh([(company, company.corporate_name, company.trade_name, company.status)])
+        company.refresh_from_db()
+        self.assertEqual(company.check_failures, 0)
+
+    def test_update_company_resets_the_failure_backoff(self):
+        company = self.create_company('11111111111111', timezone.now())
+        Company.objects.defer_failed([company])
+        Company.objects.defer_failed([company])
+        company.update_company(company.corporate_name, company.trade_name, company.status)
+        company.refresh_from_db()
+        self.assertEqual(company.check_failures, 0)
+        self.assertGreater(company.next_check_at, timezone.now() + timedelta(days=27))
@@ -0,0 +1,53 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from .. import metrics, timing
+from ..ratelimit import RateLimiter, RateLimitExceeded
+
+
+class RateLimiterTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_try_acquire_allows_up_to_rate_tokens_per_period(self):
+        rate_limiter = RateLimiter('test', rate=2, period=60)
+        self.assertEqual(rate_limiter.try_acquire(), 0)
+        self.assertEqual(rate_limiter.try_acquire(), 0)
+        self.assertGreater(rate_limiter.try_acquire(), 0)
+
+    def test_limiters_with_same_name_share_the_bucket(self):
+        RateLimiter('shared', rate=1, period=60).try_acquire()
+        self.assertGreater(RateLimiter('shared', rate=1, period=60).try_acquire(), 0)
+        self.assertEqual(RateLimiter('other', rate=1, period=60).try_acquire(), 0)
+
+    def test_acquire_records_wait_time(self):
+        metrics.reset()
+        rate_limiter = RateLimiter('waiting', rate=1, period=0.05)
+        rate_limiter.acquire()
+        with timing.track() as record:
+            waited = rate_limiter.acquire()
+        self.assertGreater(waited, 0)
+        self.assertGreater(record.stages['rate_limit'], 0)
+        self.assertEqual(metrics.get_histogram_count('ratelimit_wait_seconds', limiter='waiting'), 1)
+
+    def test_previous_window_still_counts_after_the_edge(self):
+        rate_limiter = RateLimiter('edge', rate=2, period=60)
+        with patch('restapi.ratelimit.time.time', return_value=59.0):
+            self.assertEqual(rate_limiter.try_acquire(), 0)
+            self.assertEqual(rate_limiter.try_acquire(), 0)
+        with patch('restapi.ratelimit.time.time', return_value=61.0):
+            # A fixed window would allow two more calls here.
+            self.assertAlmostEqual(rate_limiter.try_acquire(), 29.0)
+        with patch('restapi.ratelimit.time.time', return_value=91.0):
+            self.assertEqual(rate_limiter.try_acquire(), 0)
+            self.assertGreater(rate_limiter.try_acquire(), 0)
+
+    def test_acquire_raises_instead_of_waiting_past_max_wait(self):
+        rate_limiter = RateLimiter('bounded', rate=1, period=60)
+        rate_limiter.acquire()
+        with self.assertRaises(RateLimitExceeded) as raised:
+            rate_limiter.acquire(max_wait=1)
+        self.assertGreater(raised.exception.wait, 1)
+
@@ -0,0 +1,97 @@
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from .. import metrics
+from ..bulk import register_members
+from ..models import User, Company
+
+
+class ResponseCacheTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            first_name='cache',
+            last_name='user',
+            email='cache-user@hotmail.com',
+            password='123456'
+        )
+        cls.other = User.objects.create_user(
+            first_name='other',
+            last_name='user',
+            email='other-user@hotmail.com',
+            password='123456'
+        )
+        cls.company = Company.objects.create(corporate_name='company', trade_name='trade', cnpj='12345678901234')
+        cls.company.user.add(cls.user)
+        cls.companies_url = reverse('user-companies')
+        cls.members_url = reverse('company-members', args=[cls.company.id])
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.client.force_authenticate(user=self.user)
+
+    def test_second_request_is_served_from_cache(self):
+        self.client.get(self.companies_url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.companies_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['corporate_name'], 'company')
+        self.assertIn({'name': 'cache_hit_ratio', 'labels': {'cache': 'response'}, 'value': 0.5}, metrics.process_snapshot())
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get(self.companies_url)['ETag']
+        response = self.client.get(self.companies_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(metrics.get('response_cache_not_modified', view='user-companies'), 1)
+
+    def test_update_company_invalidates_member_listings(self):
+        etag = self.client.get(self.companies_url)['ETag']
+        self.company.update_company('renamed', 'trade', 'Ativa')
+        response = self.client.get(self.companies_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['corporate_name'], 'renamed')
+        self.assertGreater(metrics.get('response_cache_invalidations', scope='user'), 0)
+
+    def test_adding_member_invalidates_company_and_existing_members(self):
+        self.client.get(self.companies_url)
+        self.client.get(self.members_url)
+        self.company.user.add(self.other)
+        response = self.client.get(self.companies_url)
+        self.assertEqual(response.data[0]['user'], [self.user.id, self.other.id])
+        response = self.client.get(self.members_url)
+        self.assertEqual(len(response.data), 2)
+
+    def test_removing_member_invalidates_removed_user_listing(self):
+        self.client.force_authenticate(user=self.other)
+        self.company.user.add(self.other)
+        self.assertEqual(len(self.client.get(self.companies_url).data), 1)
+        self.other.company_set.remove(self.company)
+        self.assertEqual(len(self.client.get(self.companies_url).data), 0)
+
+    def test_saving_user_invalidates_member_listing(self):
+        self.client.get(self.members_url)
+        self.user.first_name = 'renamed'
+        self.user.save()
+        response = self.client.get(self.members_url)
+        self.assertEqual(response.data[0]['first_name'], 'renamed')
+
+    def test_padded_company_id_shares_the_cache_version(self):
+        padded_url = self.members_url.replace(f'/{self.company.id}/', f'/0{self.company.id}/')
+        self.client.get(padded_url)
+        self.user.first_name = 'renamed'
+        self.user.save()
+        self.assertEqual(self.client.get(padded_url).data[0]['first_name'], 'renamed')
+        self.assertEqual(self.client.get(self.members_url.replace(f'/{self.company.id}/', '/abc/')).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_bulk_paths_invalidate_listings(self):
+        self.client.get(self.members_url)
+        register_members([(self.company.id, self.other.id)])
+        self.assertEqual(len(self.client.get(self.members_url).data), 2)
+
+        self.client.get(self.companies_url)
+        Company.objects.apply_refresh([(self.company, 'refreshed', 'trade', 'Ativa')])
+        self.assertEqual(self.client.get(self.companies_url).data[0]['corporate_name'], 'refreshed')
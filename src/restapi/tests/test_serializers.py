@@ -1,7 +1,12 @@
+import json
+from datetime import datetime, timezone
+
 from django.test import TestCase
+from rest_framework.renderers import JSONRenderer
 
 from ..models import User, Company
-from ..serializers import UserSerializer, CompanySerializer
+from ..renderers import ORJSONRenderer
+from ..serializers import UserSerializer, CompanySerializer, CompanyValuesSerializer, UserValuesSerializer
 
 
 class UserSerializersTestCase(TestCase):
@@ -138,3 +143,35 @@ class CompanySerializersTestCase(TestCase):
             serializer.save()
         self.assertEqual(Company.objects.count(), 1)
         self.assertEqual(Company.objects.first().cnpj, 'new_cnpj')
+
+
+class ValuesSerializersTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(first_name='user', last_name=str(index), email=f'values{index}@hotmail.com', password='123456')
+            for index in range(3)
+        ]
+        cls.companies = [
+            Company.objects.create(corporate_name=f'Empresa {index}', trade_name='Fantasia', cnpj=f'{index:014d}')
+            for index in range(3)
+        ]
+        cls.companies[0].user.add(*cls.users)
+        cls.companies[1].user.add(cls.users[0])
+
+    def test_values_serializers_match_model_serializers(self):
+        companies = Company.objects.order_by('id')
+        users = User.objects.order_by('id')
+        with self.assertNumQueries(2):
+            company_data = CompanyValuesSerializer(list(CompanyValuesSerializer.values(companies))).data
+        with self.assertNumQueries(1):
+            user_data = UserValuesSerializer(list(UserValuesSerializer.values(users))).data
+        expected = CompanySerializer(companies, many=True).data
+        self.assertEqual([[*row.items()] for row in company_data], [[*row.items()] for row in expected])
+        self.assertEqual(company_data[2]['user'], [])
+        self.assertEqual(json.loads(JSONRenderer().render(user_data)), json.loads(JSONRenderer().render(UserSerializer(users, many=True).data)))
+
+    def test_orjson_renderer_matches_json_renderer(self):
+        data = [{'id': 1, 'name': 'ação', 'at': datetime(2022, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc), 'user': [1, 2]}]
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
@@ -1,8 +1,201 @@
+from datetime import timedelta
+from unittest.mock import Mock, patch
+
+from django.conf import settings
+from django.core.cache import cache
 from django.test import TestCase, override_settings
-from restapi.tasks import periodic_companies_maintenance
+from django.utils import timezone
+
+from restapi import metrics
+from restapi.models import Company
+from restapi.ratelimit import RateLimitExceeded
+from restapi.tasks import (
+    collect_companies_maintenance,
+    periodic_companies_maintenance,
+    process_due_companies,
+    queue_wait,
+    refresh_companies_batch,
+    stamp_enqueued_at,
+)
 
 
 class TasksTestCase(TestCase):
     @override_settings(CELERY_ALWAYS_EAGER=True)
     def test_periodic_companies_maintenance_has_success(self):
         self.assertTrue(periodic_companies_maintenance.delay())
+
+    @override_settings(COMPANIES_MAINTENANCE_BATCH_SIZE=1)
+    def test_periodic_companies_maintenance_refreshes_only_stale_companies(self):
+        stale = Company.objects.create(
+            corporate_name='OLD LTDA',
+            trade_name='OLD',
+            cnpj='12345678901234',
+            last_check=timezone.localtime() - timedelta(days=40)
+        )
+        Company.objects.create(corporate_name='NEW LTDA', trade_name='NEW', cnpj='11111111111111')
+        infos = {'nome': 'REFRESHED LTDA', 'fantasia': 'REFRESHED', 'situacao': 'Ativa'}
+        with patch('restapi.tasks.get_company_data_from_external_api', return_value=infos) as mock_api:
+            updated_ids = periodic_companies_maintenance()
+        mock_api.assert_called_once_with('12345678901234')
+        self.assertEqual(updated_ids, [stale.id])
+        stale.refresh_from_db()
+        self.assertEqual(stale.corporate_name, 'REFRESHED LTDA')
+
+    def test_refresh_companies_batch_reports_failures_without_stopping(self):
+        failing = Company.objects.create(corporate_name='BAD LTDA', trade_name='BAD', cnpj='12345678901234')
+        working = Company.objects.create(corporate_name='GOOD LTDA', trade_name='GOOD', cnpj='11111111111111')
+        infos = {'nome': 'GOOD SA', 'fantasia': 'GOOD', 'situacao': 'Ativa'}
+        with patch('restapi.tasks.get_company_data_from_external_api', side_effect=[Exception('boom'), infos]):
+            result = refresh_companies_batch([failing.id, working.id])
+        self.assertEqual(result['updated'], [working.id])
+        self.assertEqual(result['failed'], [{'id': failing.id, 'error': 'boom'}])
+
+    def test_refresh_companies_batch_retries_the_rest_when_rate_limited(self):
+        companies = [
+            Company.objects.create(corporate_name=f'OLD {index}', trade_name='OLD', cnpj=f'1234567890123{index}')
+            for index in range(3)
+        ]
+        infos = {'nome': 'NEW', 'fantasia': 'NEW', 'situacao': 'Ativa'}
+        with patch('restapi.tasks.get_company_data_from_external_api', side_effect=[infos, RateLimitExceeded(20)]), \
+                patch.object(refresh_companies_batch, 'retry', side_effect=RuntimeError('retry')) as mock_retry:
+            with self.assertRaisesMessage(RuntimeError, 'retry'):
+                refresh_companies_batch([company.id for company in companies])
+        kwargs = mock_retry.call_args.kwargs
+        self.assertEqual(kwargs['args'], [[companies[1].id, companies[2].id]])
+        self.assertEqual(kwargs['kwargs'], {'updated': [companies[0].id], 'failed': []})
+        self.assertEqual(kwargs['countdown'], 20)
+        companies[0].refresh_from_db()
+        self.assertEqual(companies[0].corporate_name, 'NEW')
+
+    def test_collect_companies_maintenance_merges_batch_results(self):
+        results = [
+            {'updated': [1, 2], 'failed': []},
+            {'updated': [3], 'failed': [{'id': 4, 'error': 'boom'}]},
+        ]
+        self.assertEqual(
+            collect_companies_maintenance(results),
+            {'updated': [1, 2, 3], 'failed': [{'id': 4, 'error': 'boom'}]}
+        )
+
+    @override_settings(COMPANIES_MAINTENANCE_FANOUT=True, COMPANIES_MAINTENANCE_BATCH_SIZE=2)
+    def test_periodic_companies_maintenance_fans_out_stale_companies_in_batches(self):
+        for index in range(3):
+            Company.objects.create(
+                corporate_name=f'OLD {index}',
+                trade_name='OLD',
+                cnpj=f'1234567890123{index}',
+                last_check=timezone.localtime() - timedelta(days=40)
+            )
+        with patch('restapi.tasks.chord') as mock_chord:
+            result = periodic_companies_maintenance()
+        header = mock_chord.call_args.args[0]
+        self.assertEqual(result['batches'], 2)
+        self.assertEqual([len(signature.args[0]) for signature in header], [2, 1])
+
+
+class MaintenanceInstrumentationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.companies = [
+            Company.objects.create(
+                corporate_name=f'OLD {index}',
+                trade_name='OLD',
+                cnpj=f'1234567890123{index}',
+                last_check=timezone.localtime() - timedelta(days=40)
+            )
+            for index in range(3)
+        ]
+
+    def test_periodic_companies_maintenance_reports_counts_and_stages(self):
+        infos = {'nome': 'OLD 0', 'fantasia': 'OLD', 'situacao': 'Ativa'}
+        with patch('restapi.tasks.get_company_data_from_external_api', side_effect=[infos, infos, Exception('boom')]):
+            with self.assertLogs('restapi.tasks', 'INFO') as logs:
+                periodic_companies_maintenance()
+        labels = {'task': 'periodic_companies_maintenance'}
+        self.assertEqual(metrics.get('maintenance_companies_scanned', **labels), 3)
+        self.assertEqual(metrics.get('maintenance_companies_refreshed', **labels), 2)
+        self.assertEqual(metrics.get('maintenance_companies_changed', **labels), 1)
+        self.assertEqual(metrics.get('maintenance_companies_failed', **labels), 1)
+        self.assertGreater(metrics.get('maintenance_apply_seconds_sum', **labels), 0)
+        self.assertIn('scanned=3 refreshed=2 changed=1 failed=1 skipped=0', logs.output[-1])
+
+    def test_refresh_companies_batch_counts_missing_companies_as_skipped(self):
+        infos = {'nome': 'NEW', 'fantasia': 'NEW', 'situacao': 'Ativa'}
+        with patch('restapi.tasks.get_company_data_from_external_api', return_value=infos):
+            refresh_companies_batch([company.id for company in self.companies] + [999])
+        last_run = {
+            entry['name']: entry['value'] for entry in metrics.snapshot()
+            if entry['labels'] == {'task': 'refresh_companies_batch'} and entry['name'].startswith('maintenance_last_run_')
+        }
+        self.assertEqual(last_run['maintenance_last_run_skipped'], 1)
+        self.assertEqual(last_run['maintenance_last_run_changed'], 3)
+
+    def test_queue_wait_is_measured_from_the_publish_header(self):
+        headers = {}
+        stamp_enqueued_at(headers=headers)
+        task = Mock(request=Mock(enqueued_at=headers['enqueued_at'] - 2))
+        self.assertGreaterEqual(queue_wait(task), 2)
+
+    @override_settings(METRICS_PUBLISH_INTERVAL=3600)
+    def test_worker_metrics_are_published_when_a_task_ends(self):
+        metrics.reset()
+        metrics.publish()
+        with patch('restapi.tasks.get_company_data_from_external_api', return_value={'nome': 'NEW', 'fantasia': 'NEW', 'situacao': 'Ativa'}):
+            refresh_companies_batch.apply(args=[[company.id for company in self.companies]])
+        slots = cache.get_many([f'metrics:process:{slot}' for slot in range(settings.METRICS_MAX_PROCESSES)])
+        published = [entry for slot in slots.values() for entry in slot['values']]
+        self.assertIn({'name': 'maintenance_run_seconds_count', 'labels': {'task': 'refresh_companies_batch'}, 'value': 1}, published)
+
+
+@override_settings(COMPANIES_MAINTENANCE_SLICE_SIZE=2, COMPANIES_MAINTENANCE_CHECKPOINT_SIZE=1)
+class ProcessDueCompaniesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.companies = [
+            Company.objects.create(
+                corporate_name=f'OLD {index}',
+                trade_name='OLD',
+                cnpj=f'1234567890123{index}',
+                next_check_at=now - timedelta(hours=3 - index)
+            )
+            for index in range(3)
+        ]
+
+    def test_process_due_companies_refreshes_one_slice(self):
+        infos = {'nome': 'NEW', 'fantasia': 'NEW', 'situacao': 'Ativa'}
+        with patch('restapi.tasks.get_company_data_from_external_api', return_value=infos):
+            result = process_due_companies()
+        self.assertEqual(result, {'updated': [self.companies[0].id, self.companies[1].id], 'failed': [], 'backlog': 1})
+        self.assertEqual(list(Company.objects.due().values_list('id', flat=True)), [self.companies[2].id])
+
+    def test_process_due_companies_retries_failures_later(self):
+        with patch('restapi.tasks.get_company_data_from_external_api', side_effect=Exception('boom')):
+            result = process_due_companies()
+        self.assertEqual([item['id'] for item in result['failed']], [self.companies[0].id, self.companies[1].id])
+        self.companies[0].refresh_from_db()
+        self.assertGreater(self.companies[0].next_check_at, timezone.now() + timedelta(minutes=50))
+        self.assertLess(self.companies[0].next_check_at, timezone.now() + timedelta(hours=2))
+
+    def test_companies_left_by_a_crashed_run_come_due_after_the_lease(self):
+        infos = {'nome': 'NEW', 'fantasia': 'NEW', 'situacao': 'Ativa'}
+        with patch('restapi.tasks.get_company_data_from_external_api', side_effect=[infos, KeyboardInterrupt]):
+            with self.assertRaises(KeyboardInterrupt):
+                process_due_companies()
+        self.assertEqual(list(Company.objects.due().values_list('id', flat=True)), [self.companies[2].id])
+        later = timezone.now() + timedelta(seconds=settings.COMPANIES_MAINTENANCE_LEASE + 1)
+        self.assertEqual(
+            sorted(Company.objects.due(later).exclude(id=self.companies[2].id).values_list('id', flat=True)),
+            [self.companies[1].id]
+        )
+
+    def test_process_due_companies_hands_the_slice_back_when_rate_limited(self):
+        infos = {'nome': 'NEW', 'fantasia': 'NEW', 'situacao': 'Ativa'}
+        with patch('restapi.tasks.get_company_data_from_external_api', side_effect=[infos, RateLimitExceeded(120)]):
+            result = process_due_companies()
+        self.assertEqual(result['updated'], [self.companies[0].id])
+        self.companies[1].refresh_from_db()
+        self.assertLess(self.companies[1].next_check_at, timezone.now() + timedelta(minutes=3))
+        self.assertGreater(self.companies[1].next_check_at, timezone.now() + timedelta(minutes=1))
+
@@ -0,0 +1,57 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+
+from ..models import User
+from ..token import create_auth_token_for_all_users
+
+
+class TokenTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(first_name='user', last_name=str(index), email=f'user{index}@hotmail.com', password='123456')
+            for index in range(5)
+        ]
+
+    def test_create_auth_token_on_user_creation(self):
+        self.assertTrue(Token.objects.filter(user=self.users[0]).exists())
+
+    def test_create_auth_token_for_all_users_fills_missing_tokens_in_batches(self):
+        Token.objects.filter(user__in=self.users[1:]).delete()
+        kept_key = Token.objects.get(user=self.users[0]).key
+        progress = []
+        with self.assertNumQueries(7):
+            created = create_auth_token_for_all_users(batch_size=2, progress=lambda *args: progress.append(args))
+        self.assertEqual(created, 4)
+        self.assertEqual(progress, [(2, self.users[2].id), (4, self.users[4].id)])
+        self.assertEqual(Token.objects.count(), 5)
+        self.assertEqual(Token.objects.get(user=self.users[0]).key, kept_key)
+
+    def test_create_auth_token_for_all_users_counts_only_inserted_tokens(self):
+        Token.objects.filter(user__in=self.users[1:]).delete()
+        generate_key = Token.generate_key
+
+        def signup_meanwhile():
+            # The user gets a token between the anti-join and the insert.
+            if not Token.objects.filter(user=self.users[1]).exists():
+                Token.objects.create(user=self.users[1], key='racing'.ljust(40, '0'))
+            return generate_key()
+
+        with patch.object(Token, 'generate_key', side_effect=signup_meanwhile):
+            created = create_auth_token_for_all_users()
+        self.assertEqual(created, 3)
+        self.assertEqual(Token.objects.get(user=self.users[1]).key, 'racing'.ljust(40, '0'))
+
+    def test_create_auth_token_for_all_users_is_idempotent(self):
+        self.assertEqual(create_auth_token_for_all_users(), 0)
+
+    def test_backfill_tokens_command_reports_progress(self):
+        Token.objects.all().delete()
+        out = StringIO()
+        call_command('backfill_tokens', '--batch-size', '3', stdout=out)
+        self.assertIn('3 tokens created', out.getvalue())
+        self.assertIn('Done: 5 tokens created.', out.getvalue())
@@ -1,10 +1,20 @@
-from unittest.mock import Mock, patch
+import json
+from datetime import timedelta
+from unittest.mock import patch
 
+from django.core.cache import cache
+from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase
 
-from ..models import User, Company
+from benchmarks.stub import StubCNPJServer, company_payload
+
+from .. import metrics
+from ..cnpj import cnpj_cache
+from ..models import User, Company, CompanyChange
 from ..views import get_company_data_from_external_api
 
 
@@ -28,6 +38,9 @@ class UserViewSetTestCase(APITestCase):
         cls.create_url = reverse('user-list')
         cls.list_url = reverse('user-companies')
 
+    def setUp(self):
+        cache.clear()
+
     def test_creates_user_without_authentication_returns_201(self):
         data = {
             'first_name': 'user',
@@ -108,6 +121,35 @@ class UserViewSetTestCase(APITestCase):
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data[0]['corporate_name'], 'test_company')
 
+    def test_get_logged_user_companies_query_count_does_not_grow_with_companies(self):
+        self.client.force_authenticate(user=self.user)
+        with self.assertNumQueries(2):
+            self.client.get(self.list_url, format='json')
+        for index in range(5):
+            company = Company.objects.create(corporate_name=f'company {index}', trade_name='trade', cnpj=f'5555555555555{index}')
+            company.user.add(self.user)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.list_url, format='json')
+        self.client.force_authenticate(user=None)
+        self.assertEqual(len(response.data), 6)
+        self.assertEqual(response.data[0]['user'], [self.user.id])
+
+    def test_get_logged_user_companies_paginates_with_link_header(self):
+        for index in range(2):
+            company = Company.objects.create(corporate_name=f'company {index}', trade_name='trade', cnpj=f'5555555555555{index}')
+            company.user.add(self.user)
+        self.client.force_authenticate(user=self.user)
+        first_page = self.client.get(self.list_url, {'page_size': 2}, format='json')
+        next_url = first_page['Link'].split(';')[0].strip('<>')
+        second_page = self.client.get(next_url, format='json')
+        self.client.force_authenticate(user=None)
+        self.assertEqual(len(first_page.data), 2)
+        self.assertEqual(len(second_page.data), 1)
+        self.assertIn('rel="next"', first_page['Link'])
+        self.assertNotIn('rel="next"', second_page['Link'])
+        ids = [company['id'] for company in first_page.data + second_page.data]
+        self.assertEqual(ids, sorted(ids))
+
     def test_get_logged_user_companies_returns_401_when_user_is_not_logged(self):
         self.client.force_authenticate(user=None)
         response = self.client.get(self.list_url, format='json')
@@ -150,6 +192,7 @@ class CompanyViewSetTestCase(APITestCase):
 
 
     def setUp(self):
+        cache.clear()
         self.client.force_authenticate(user=self.django_user)
     
     def tearDown(self):
@@ -191,6 +234,25 @@ class CompanyViewSetTestCase(APITestCase):
         response = self.client.get(self.company_members_url, format='json')
         self.assertEqual(len(response.data), 1)
     
+    def test_get_members_from_company_query_count_does_not_grow_with_members(self):
+        with self.assertNumQueries(1):
+            self.client.get(self.company_members_url, format='json')
+        for index in range(5):
+            user = User.objects.create_user(
+                first_name='member', last_name=str(index), email=f'member{index}@hotmail.com', password='123456'
+            )
+            self.company_django.user.add(user)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.company_members_url, format='json')
+        self.assertEqual(len(response.data), 6)
+
+    @override_settings(API_PAGE_SIZE=1)
+    def test_get_members_from_company_returns_one_page_of_members(self):
+        self.company_django.user.add(self.another_user)
+        response = self.client.get(self.company_members_url, format='json')
+        self.assertEqual([member['id'] for member in response.data], [self.django_user.id])
+        self.assertIn('rel="next"', response['Link'])
+
     def test_registry_member_in_company_returns_200_with_authenticated_user(self):
         data = {
             'user_id': self.another_user.id,
@@ -242,20 +304,346 @@ class CompanyViewSetTestCase(APITestCase):
         self.assertNotEqual(self.company_django.user.all().count(), qty_users_before_post)
     
 
+class CompanyBulkCreateTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            first_name='bulk',
+            last_name='user',
+            email='bulk@hotmail.com',
+            password='123456'
+        )
+        Company.objects.create(corporate_name='existing', trade_name='existing', cnpj='11111111111111')
+        cls.bulk_url = reverse('company-bulk')
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        self.client.force_authenticate(user=None)
+
+    def company(self, cnpj, **extra):
+        return {'corporate_name': f'company {cnpj}', 'trade_name': 'trade', 'cnpj': cnpj, **extra}
+
+    def test_bulk_create_companies_creates_every_valid_company(self):
+        data = [self.company('22222222222222', user=[self.user.id]), self.company('33333333333333')]
+        response = self.client.post(self.bulk_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        created = Company.objects.get(id=response.data['results'][0]['id'])
+        self.assertEqual(created.cnpj, '22222222222222')
+        self.assertEqual(list(created.user.all()), [self.user])
+
+    def test_bulk_create_companies_keeps_valid_rows_on_partial_failure(self):
+        data = [
+            self.company('22222222222222'),
+            self.company('11111111111111'),
+            self.company('22222222222222'),
+            {'cnpj': '44444444444444'},
+        ]
+        response = self.client.post(self.bulk_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['created', 'invalid', 'invalid', 'invalid']
+        )
+        self.assertIn('cnpj', response.data['results'][1]['errors'])
+        self.assertTrue(Company.objects.filter(cnpj='22222222222222').exists())
+
+    def test_bulk_create_companies_rolls_back_everything_when_atomic(self):
+        data = [self.company('22222222222222'), self.company('11111111111111')]
+        response = self.client.post(f'{self.bulk_url}?atomic=true', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['results'][0]['status'], 'skipped')
+        self.assertFalse(Company.objects.filter(cnpj='22222222222222').exists())
+
+    def test_bulk_create_companies_accepts_ndjson(self):
+        body = '\n'.join(json.dumps(self.company(cnpj)) for cnpj in ('22222222222222', '33333333333333'))
+        response = self.client.post(self.bulk_url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Company.objects.count(), 3)
+
+    def test_bulk_create_companies_returns_400_when_body_is_not_a_list(self):
+        response = self.client.post(self.bulk_url, self.company('22222222222222'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_create_companies_returns_401_if_user_not_authenticated(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.post(self.bulk_url, [self.company('22222222222222')], format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class CompanyBulkMembersTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(first_name='member', last_name=str(index), email=f'member{index}@hotmail.com', password='123456')
+            for index in range(3)
+        ]
+        cls.company = Company.objects.create(corporate_name='company', trade_name='trade', cnpj='12345678901234')
+        cls.company.user.add(cls.users[0])
+        cls.bulk_url = reverse('company-registry-members-bulk')
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.users[0])
+
+    def tearDown(self):
+        self.client.force_authenticate(user=None)
+
+    def test_registry_members_reports_added_present_and_invalid_members(self):
+        data = {'company_id': self.company.id, 'user_ids': [user.id for user in self.users] + [999, 'abc']}
+        response = self.client.post(self.bulk_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([pair['user_id'] for pair in response.data['added']], [self.users[1].id, self.users[2].id])
+        self.assertEqual([pair['user_id'] for pair in response.data['already_present']], [self.users[0].id])
+        self.assertEqual([pair['user_id'] for pair in response.data['invalid']], ['abc', 999])
+        self.assertEqual(self.company.user.count(), 3)
+
+    def test_registry_members_accepts_pairs_with_constant_queries(self):
+        other = Company.objects.create(corporate_name='other', trade_name='trade', cnpj='11111111111111')
+        pairs = [
+            {'company_id': company.id, 'user_id': user.id}
+            for company in (self.company, other) for user in self.users
+        ] + [{'company_id': 999, 'user_id': self.users[0].id}]
+        with self.assertNumQueries(5):
+            response = self.client.post(self.bulk_url, {'pairs': pairs}, format='json')
+        self.assertEqual(len(response.data['added']), 5)
+        self.assertEqual(response.data['invalid'][0]['error'], 'company not found')
+        self.assertEqual(other.user.count(), 3)
+
+    def test_registry_members_returns_400_without_members(self):
+        response = self.client.post(self.bulk_url, {'company_id': self.company.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_registry_members_returns_400_for_a_json_array(self):
+        data = [{'company_id': self.company.id, 'user_id': self.users[1].id}]
+        response = self.client.post(self.bulk_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MetricsViewTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(first_name='metrics', last_name='user', email='metrics@hotmail.com', password='123456')
+        cls.admin = User.objects.create_superuser(first_name='admin', last_name='user', email='admin-metrics@hotmail.com', password='123456')
+        cls.metrics_url = reverse('api_metrics')
+
+    def test_get_metrics_returns_403_for_regular_users(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(self.metrics_url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_get_metrics_includes_registered_collectors(self):
+        self.client.force_authenticate(user=self.admin)
+        with patch('saas.db.base.pool_stats', return_value={'default': {'checkouts': 3}}):
+            response = self.client.get(self.metrics_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn({'name': 'db_pool_checkouts', 'labels': {'alias': 'default', 'process': metrics.process_id()}, 'value': 3}, response.data)
+
+    def test_get_metrics_includes_every_process(self):
+        cache.clear()
+        metrics.reset()
+        cache.set('metrics:process:0', {'process': 'worker:1', 'values': [{'name': 'http_requests', 'labels': {'view': 'company'}, 'value': 2.0}]})
+        metrics.incr('http_requests', view='company')
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(self.metrics_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        requests = [entry for entry in response.data if entry['name'] == 'http_requests' and entry['labels']['view'] == 'company']
+        self.assertEqual(requests, [
+            {'name': 'http_requests', 'labels': {'view': 'company', 'process': 'worker:1'}, 'value': 2.0},
+            {'name': 'http_requests', 'labels': {'view': 'company', 'process': metrics.process_id()}, 'value': 1.0},
+        ])
+
+
+@override_settings(CNPJ_API_RATE_LIMIT=1000)
 class CompanyExternalDataTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        cnpj_cache.clear_local()
+
     def test_get_company_external_data_returns_right_keys(self):
-        with patch('restapi.views.requests.get') as mock_get:
-            expected_values = {
-                'nome': 'company LTDA',
-                'fantasia': 'company',
-                'situacao': 'Ativa',
-                'cnpj': '99315678901234',
-                'data_situacao': '2019-01-01',
-                'uf': 'SP',
-            }
-
-            mock_get.return_value = Mock(status_code=200)
-            mock_get.return_value.json.return_value = expected_values
-            response = get_company_data_from_external_api('12345678901234')
-
-        self.assertEqual(set(response.keys()), set({'nome', 'fantasia', 'situacao'}))
\ No newline at end of file
+        expected_values = {
+            'nome': 'company LTDA',
+            'fantasia': 'company',
+            'situacao': 'Ativa',
+            'cnpj': '99315678901234',
+            'data_situacao': '2019-01-01',
+            'uf': 'SP',
+        }
+        with StubCNPJServer({'12345678901234': expected_values}) as stub:
+            with override_settings(CNPJ_API_URL=stub.url):
+                response = get_company_data_from_external_api('12345678901234')
+
+        self.assertEqual(set(response.keys()), set({'nome', 'fantasia', 'situacao'}))
+
+
+@override_settings(CNPJ_API_RATE_LIMIT=1000)
+class CompanyAsyncViewsTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.django_user = User.objects.create_user(
+            first_name='django',
+            last_name='user',
+            email='admin@hotmail.com',
+            password='admin123'
+        )
+        cls.token = Token.objects.get(user=cls.django_user)
+        cls.create_url = reverse('company-create')
+
+    def setUp(self):
+        cache.clear()
+        cnpj_cache.clear_local()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_lookup_company_returns_external_data(self):
+        with StubCNPJServer({'12345678901234': company_payload('company LTDA', situacao='ATIVA')}) as stub:
+            with override_settings(CNPJ_API_URL=stub.url):
+                response = self.client.get(reverse('company-lookup', args=['12345678901234']))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {
+            'cnpj': '12345678901234',
+            'corporate_name': 'company LTDA',
+            'trade_name': 'company LTDA',
+            'status': 'ATIVA',
+        })
+
+    def test_lookup_company_returns_401_without_token(self):
+        self.client.credentials()
+        response = self.client.get(reverse('company-lookup', args=['12345678901234']))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_lookup_company_returns_400_for_invalid_cnpj(self):
+        response = self.client.get(reverse('company-lookup', args=['123']))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_lookup_company_returns_404_for_unknown_cnpj(self):
+        with StubCNPJServer() as stub:
+            with override_settings(CNPJ_API_URL=stub.url):
+                response = self.client.get(reverse('company-lookup', args=['12345678901234']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(CNPJ_API_RATE_LIMIT=1, CNPJ_API_MAX_WAIT=0)
+    def test_lookup_company_returns_429_when_rate_limited(self):
+        companies = {cnpj: company_payload('company LTDA') for cnpj in ('12345678901234', '11111111111111')}
+        with StubCNPJServer(companies) as stub:
+            with override_settings(CNPJ_API_URL=stub.url):
+                self.client.get(reverse('company-lookup', args=['12345678901234']))
+                response = self.client.get(reverse('company-lookup', args=['11111111111111']))
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_create_company_with_enrich_fills_names_and_status(self):
+        data = {'corporate_name': '', 'trade_name': '', 'cnpj': '12345678901234', 'user': [self.django_user.id]}
+        with StubCNPJServer({'12345678901234': company_payload('company LTDA', 'company', 'BAIXADA')}) as stub:
+            with override_settings(CNPJ_API_URL=stub.url):
+                response = self.client.post(f'{self.create_url}?enrich=true', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        company = Company.objects.get(cnpj='12345678901234')
+        self.assertEqual((company.corporate_name, company.trade_name, company.status), ('company LTDA', 'company', 'BAIXADA'))
+
+    def test_create_company_with_enrich_requires_a_token(self):
+        self.client.credentials()
+        data = {'corporate_name': 'new', 'trade_name': 'company', 'cnpj': '12345678901234'}
+        with StubCNPJServer() as stub:
+            with override_settings(CNPJ_API_URL=stub.url):
+                response = self.client.post(f'{self.create_url}?enrich=true', data, format='json')
+                with override_settings(COMPANY_ENRICH_ON_CREATE=True):
+                    default_response = self.client.post(self.create_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(default_response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(stub.requests, [])
+        self.assertFalse(Company.objects.filter(cnpj='12345678901234').exists())
+
+    @override_settings(CNPJ_LOOKUP_USER_RATE_LIMIT=1)
+    def test_lookup_company_is_rate_limited_per_user(self):
+        with StubCNPJServer({'12345678901234': company_payload('company LTDA')}) as stub:
+            with override_settings(CNPJ_API_URL=stub.url):
+                self.client.get(reverse('company-lookup', args=['12345678901234']))
+                response = self.client.get(reverse('company-lookup', args=['12345678901234']))
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(len(stub.requests), 1)
+
+    def test_create_company_without_enrich_does_not_call_external_api(self):
+        data = {'corporate_name': 'new', 'trade_name': 'company', 'cnpj': '12345678901234', 'user': [self.django_user.id]}
+        with StubCNPJServer() as stub:
+            with override_settings(CNPJ_API_URL=stub.url):
+                with patch('restapi.views.async_to_sync') as async_to_sync:
+                    response = self.client.post(self.create_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(stub.requests, [])
+        async_to_sync.assert_not_called()
+
+
+@override_settings(COMPANY_CHANGES_SAFETY_LAG=0)
+class CompanyChangesTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            first_name='changes',
+            last_name='user',
+            email='changes-user@hotmail.com',
+            password='123456'
+        )
+        cls.company = Company.objects.create(corporate_name='OLD LTDA', trade_name='OLD', cnpj='12345678901234')
+        cls.company.user.add(cls.user)
+        cls.other = Company.objects.create(corporate_name='OTHER LTDA', trade_name='OTHER', cnpj='11111111111111')
+        cls.changes_url = reverse('company-changes')
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.user)
+
+    def read_changes(self, **params):
+        response = self.client.get(self.changes_url, params)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_update_company_records_changed_fields_only(self):
+        self.company.update_company('NEW LTDA', 'OLD', 'BAIXADA')
+        changes = self.read_changes()
+        self.assertEqual(
+            [(change['field'], change['old_value'], change['new_value']) for change in changes],
+            [('corporate_name', 'OLD LTDA', 'NEW LTDA'), ('status', 'Ativa', 'BAIXADA')]
+        )
+        self.assertEqual({change['company_id'] for change in changes}, {self.company.id})
+
+    def test_apply_refresh_writes_changes_in_bulk(self):
+        refreshed = [(self.company, 'NEW LTDA', 'OLD', 'Ativa'), (self.other, 'OTHER LTDA', 'OTHER', 'Ativa')]
+        with self.assertNumQueries(6):
+            Company.objects.apply_refresh(refreshed)
+        self.assertEqual([change['new_value'] for change in self.read_changes()], ['NEW LTDA'])
+
+    def test_since_resumes_after_the_cursor(self):
+        self.company.update_company('FIRST', 'OLD', 'Ativa')
+        first, = self.read_changes()
+        self.company.update_company('SECOND', 'OLD', 'Ativa')
+        self.assertEqual([change['new_value'] for change in self.read_changes(since=first['id'])], ['SECOND'])
+        self.assertEqual(len(self.read_changes(limit=1)), 1)
+
+    def test_changes_are_limited_to_member_companies_unless_admin(self):
+        self.other.update_company('OTHER SA', 'OTHER', 'Ativa')
+        self.assertEqual(self.read_changes(), [])
+        admin = User.objects.create_superuser('admin', 'user', 'changes-admin@hotmail.com', '123456')
+        self.client.force_authenticate(user=admin)
+        self.assertEqual(len(self.read_changes()), 1)
+
+    @override_settings(COMPANY_CHANGES_SAFETY_LAG=60)
+    def test_changes_wait_for_transactions_still_in_flight(self):
+        # Two refreshes interleave: the one that started later inserts first
+        # and gets the lower id, the earlier one commits the higher id.
+        now = timezone.now()
+        committed = CompanyChange.objects.create(
+            company=self.company, field='status', old_value='Ativa', new_value='BAIXADA', changed_at=now - timedelta(minutes=5)
+        )
+        later = CompanyChange.objects.create(
+            company=self.company, field='trade_name', old_value='OLD', new_value='LATER', changed_at=now - timedelta(seconds=10)
+        )
+        earlier = CompanyChange.objects.create(
+            company=self.company, field='corporate_name', old_value='OLD LTDA', new_value='EARLIER', changed_at=now - timedelta(seconds=70)
+        )
+        self.assertEqual([change['id'] for change in self.read_changes()], [committed.id])
+        with patch('restapi.views.timezone.now', return_value=now + timedelta(minutes=1)):
+            self.assertEqual([change['id'] for change in self.read_changes(since=committed.id)], [later.id, earlier.id])
+
+    def test_invalid_cursor_returns_400(self):
+        response = self.client.get(self.changes_url, {'since': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,77 @@
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+
+
+_current = ContextVar('timing', default=None)
+
+_IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def sql_shape(sql):
+    # Queries that only differ by literals or by the length of an IN list
+    # share a shape, so a loop issuing one query per row stands out.
+    return _LITERAL.sub('?', _IN_LIST.sub('(%s)', sql))
+
+
+class Timing:
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.queries = 0
+        self.shapes = Counter()
+
+    def execute(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook.
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.stages['db'] += time.perf_counter() - started_at
+            self.queries += 1
+            self.shapes[sql_shape(sql)] += 1
+
+    def repeated_shapes(self, threshold):
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def track():
+    # Collects queries, DB time and stages for the enclosed block, whether a
+    # request or a task run.
+    record = Timing()
+    token = _current.set(record)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(record.execute))
+            yield record
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name):
+    # Adds the time spent in the block to the tracked request or task, if any.
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.stages[name] += time.perf_counter() - started_at
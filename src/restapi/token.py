@@ -11,6 +11,22 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
         Token.objects.create(user=instance)
 
 
-def create_auth_token_for_all_users():
-    for user in User.objects.all():
-        Token.objects.get_or_create(user=user)
\ No newline at end of file
+def create_auth_token_for_all_users(batch_size=None, progress=None):
+    # Tokens are inserted chunk by chunk for users found by an anti-join, so an
+    # interrupted run simply resumes with the users still missing a token.
+    batch_size = batch_size or settings.BULK_CREATE_BATCH_SIZE
+    missing = User.objects.filter(auth_token__isnull=True).order_by('id')
+    created = 0
+    last_id = 0
+    while True:
+        user_ids = list(missing.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+        if not user_ids:
+            return created
+        tokens = [Token(user_id=user_id, key=Token.generate_key()) for user_id in user_ids]
+        Token.objects.bulk_create(tokens, ignore_conflicts=True)
+        # A signup racing the backfill keeps its own token and ours is dropped,
+        # so only the keys that made it in are counted.
+        created += Token.objects.filter(key__in=[token.key for token in tokens]).count()
+        last_id = user_ids[-1]
+        if progress is not None:
+            progress(created, last_id)
\ No newline at end of file
@@ -1,7 +1,8 @@
 from rest_framework.routers import DefaultRouter
 from rest_framework.authtoken.views import obtain_auth_token
+from django.conf import settings
 from django.urls import path, include
-from .views import UserViewSet, CompanyViewSet
+from .views import UserViewSet, CompanyViewSet, create_company, create_company_async, get_metrics, get_prometheus_metrics, logout, lookup_company
 
 
 router = DefaultRouter()
@@ -9,8 +10,13 @@ router.register(r'user', UserViewSet, basename='user')
 router.register(r'company', CompanyViewSet, basename='company')
 
 api_urls = [
+    path('api/company/', create_company_async if settings.ASGI else create_company, name='company-create'),
+    path('api/company/lookup/<str:cnpj>/', lookup_company, name='company-lookup'),
     path('api/', include(router.urls)),
     path('api/login/', obtain_auth_token, name='api_login'),
+    path('api/logout/', logout, name='api_logout'),
+    path('api/metrics/', get_metrics, name='api_metrics'),
+    path('api/metrics/prometheus/', get_prometheus_metrics, name='api_metrics_prometheus'),
 ]
 
 
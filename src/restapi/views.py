@@ -1,12 +1,39 @@
-import requests
+import json
+import math
+from datetime import timedelta
+from itertools import takewhile
+
+import httpx
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from rest_framework import viewsets
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from rest_framework.renderers import BrowsableAPIRenderer
+
+from . import exports, metrics
+from .authentication import CachedTokenAuthentication
+from .bulk import register_companies, register_members
+from .cnpj import CNPJLookupError, CNPJRateLimitError, async_cnpj_client, get_cnpj_client
+from .pagination import LinkHeaderCursorPagination
+from .ratelimit import RateLimiter, RateLimitExceeded
+from .response_cache import cached_response
+from .timing import stage
+from .parsers import NDJSONParser
+from .renderers import ORJSONRenderer
+from .serializers import UserSerializer, CompanySerializer, CompanyValuesSerializer, UserValuesSerializer
+from .streaming import iter_ndjson
+from .models import User, Company, CompanyChange
+
 
-from .serializers import UserSerializer, CompanySerializer
-from .models import User, Company
+# The list actions return plain dicts and lists, so orjson can encode them.
+LIST_RENDERERS = [ORJSONRenderer, BrowsableAPIRenderer]
 
 
 class UserViewSet(viewsets.ViewSet):
@@ -24,12 +51,19 @@ class UserViewSet(viewsets.ViewSet):
         serializer.save()
         return Response(serializer.data, status=201)
     
-    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated], url_path='companies', url_name='companies')
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated], url_path='companies', url_name='companies', renderer_classes=LIST_RENDERERS)
     def get_logged_user_companies(self, request):
         user_id = request.user.id
-        queryset = Company.objects.filter(user__id=user_id)
-        serializer = CompanySerializer(queryset, many=True)
-        return Response(serializer.data)
+
+        def build():
+            queryset = CompanyValuesSerializer.values(Company.objects.filter(user__id=user_id))
+            paginator = LinkHeaderCursorPagination()
+            page = paginator.paginate_queryset(queryset, request, view=self)
+            with stage('serializer'):
+                data = CompanyValuesSerializer(page).data
+            return paginator.get_paginated_response(data)
+
+        return cached_response(request, 'user-companies', 'user', user_id, build)
     
     def get_extra_action_url_map(self):
         return []
@@ -45,17 +79,95 @@ class CompanyViewSet(viewsets.ViewSet):
             'cnpj': request.data.get('cnpj'),
             'user': request.data.get('user')
         }
+        extra = {}
+        enrichment = getattr(request, 'company_enrichment', None)
+        if enrichment:
+            data['corporate_name'] = data['corporate_name'] or enrichment['corporate_name']
+            data['trade_name'] = data['trade_name'] or enrichment['trade_name']
+            extra['status'] = enrichment['status']
         serializer = CompanySerializer(data=data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=400)
-        serializer.save()
+        serializer.save(**extra)
         return Response(serializer.data, status=201)
 
-    @action(detail=True, methods=['get'], url_path='members', url_name='members', permission_classes=[IsAuthenticated])
+    @action(detail=False, methods=['post'], url_path='bulk', url_name='bulk', permission_classes=[IsAuthenticated], parser_classes=[JSONParser, NDJSONParser])
+    def bulk_create_companies(self, request):
+        if not isinstance(request.data, list):
+            return Response({'error': 'expected a JSON array or an NDJSON stream'}, status=400)
+        atomic = request.query_params.get('atomic', '').lower() in ('1', 'true')
+        results = register_companies(request.data, atomic=atomic)
+        created = sum(1 for result in results if result['status'] == 'created')
+        if created == len(results):
+            status = 201
+        elif created:
+            status = 207
+        else:
+            status = 400
+        return Response({'created': created, 'failed': len(results) - created, 'results': results}, status=status)
+
+    @action(detail=True, methods=['get'], url_path='members', url_name='members', permission_classes=[IsAuthenticated], renderer_classes=LIST_RENDERERS)
     def get_members_from_company(self, request, pk=None):
-        queryset = User.objects.filter(company__id=pk)
-        serializer = UserSerializer(queryset, many=True)
-        return Response(serializer.data)
+        # The cache version is keyed by the id, so /05/ must share it with /5/.
+        try:
+            pk = int(pk)
+        except ValueError:
+            raise Http404
+
+        def build():
+            queryset = UserValuesSerializer.values(User.objects.filter(company__id=pk))
+            paginator = LinkHeaderCursorPagination()
+            page = paginator.paginate_queryset(queryset, request, view=self)
+            with stage('serializer'):
+                data = UserValuesSerializer(page).data
+            return paginator.get_paginated_response(data)
+
+        return cached_response(request, 'company-members', 'company', pk, build)
+
+    @action(detail=False, methods=['get'], url_path='changes', url_name='changes', permission_classes=[IsAuthenticated])
+    def get_company_changes(self, request):
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = int(request.query_params.get('limit', settings.COMPANY_CHANGES_PAGE_SIZE))
+        except ValueError:
+            return Response({'error': 'since and limit must be integers'}, status=400)
+        if since < 0 or limit < 1:
+            return Response({'error': 'since must be >= 0 and limit >= 1'}, status=400)
+        queryset = CompanyChange.objects.filter(id__gt=since)
+        if not request.user.is_staff:
+            queryset = queryset.filter(company__user=request.user)
+        rows = queryset.order_by('id').values(
+            'id', 'company_id', 'field', 'old_value', 'new_value', 'changed_at'
+        )[:min(limit, settings.COMPANY_CHANGES_MAX_PAGE_SIZE)]
+        # Ids are handed out at insert, not at commit, so a transaction still
+        # in flight can commit a lower id after the consumer moved past it.
+        # The page stops at the first change younger than the safety lag,
+        # by which time every lower id has committed.
+        cutoff = timezone.now() - timedelta(seconds=settings.COMPANY_CHANGES_SAFETY_LAG)
+        rows = takewhile(lambda row: row['changed_at'] <= cutoff, rows.iterator())
+        return StreamingHttpResponse(iter_ndjson(rows), content_type='application/x-ndjson')
+
+    @action(detail=False, methods=['get'], url_path='export', url_name='export', permission_classes=[IsAuthenticated])
+    def export_companies(self, request):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in exports.OUTPUTS:
+            return Response({'error': f'output must be one of {", ".join(exports.OUTPUTS)}'}, status=400)
+        rows = exports.company_rows(user=None if request.user.is_staff else request.user)
+        return export_response(rows, exports.COMPANY_FIELDS, output, 'companies')
+
+    @action(detail=False, methods=['get'], url_path='members/export', url_name='members-export', permission_classes=[IsAuthenticated])
+    def export_members(self, request):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in exports.OUTPUTS:
+            return Response({'error': f'output must be one of {", ".join(exports.OUTPUTS)}'}, status=400)
+        company_ids = request.query_params.get('company_id')
+        if company_ids is not None:
+            try:
+                company_ids = [int(company_id) for company_id in company_ids.split(',')]
+            except ValueError:
+                return Response({'error': 'company_id must be a comma separated list of integers'}, status=400)
+        rows = exports.member_rows(company_ids, user=None if request.user.is_staff else request.user)
+        return export_response(rows, exports.MEMBER_FIELDS, output, 'members')
 
     @action(detail=False, methods=['post'], url_path='members/registry', url_name='registry-member', permission_classes=[IsAuthenticated])
     def registry_member_in_company(self, request):
@@ -68,23 +180,160 @@ class CompanyViewSet(viewsets.ViewSet):
         company.user.add(user)
         return Response({'message': 'success'}, status=200)
     
+    @action(detail=False, methods=['post'], url_path='members/registry/bulk', url_name='registry-members-bulk', permission_classes=[IsAuthenticated])
+    def registry_members_in_companies(self, request):
+        if not isinstance(request.data, dict):
+            return Response({'error': 'expected a JSON object with pairs or company_id and user_ids'}, status=400)
+        if 'pairs' in request.data:
+            pairs = request.data['pairs']
+            if not isinstance(pairs, list) or not all(isinstance(pair, dict) for pair in pairs):
+                return Response({'error': 'pairs must be a list of objects'}, status=400)
+            pairs = [(pair.get('company_id'), pair.get('user_id')) for pair in pairs]
+        else:
+            company_id = request.data.get('company_id', None)
+            user_ids = request.data.get('user_ids', None)
+            if not company_id or not isinstance(user_ids, list):
+                return Response({'error': 'pairs or company_id and user_ids are required'}, status=400)
+            pairs = [(company_id, user_id) for user_id in user_ids]
+        return Response(register_members(pairs), status=200)
+
     def get_extra_action_url_map(self):
         return []
 
 
+def export_response(rows, fields, output, name):
+    response = StreamingHttpResponse(exports.encode(rows, fields, output), content_type=exports.CONTENT_TYPES[output])
+    response['Content-Disposition'] = f'attachment; filename="{name}.{output}"'
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def logout(request):
+    if request.auth is not None:
+        request.auth.delete()
+    return Response(status=204)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_metrics(request):
+    return Response(metrics.snapshot())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_prometheus_metrics(request):
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def get_company_data_from_external_api(cnpj):
-    entrypoint = 'https://receitaws.com.br/v1/'
-    
-    url = f'{entrypoint}cnpj/{cnpj}'
-    response = requests.get(url)
-    response = response.json()
-    if response.get('status') == 'ERROR':
-        raise Exception(f'Não foi possível obter os dados da empresa {cnpj}')
+    return get_cnpj_client().get_company_data(cnpj)
+
+
+async def get_company_enrichment(cnpj):
+    async with async_cnpj_client() as client:
+        infos = await client.get_company_data(cnpj)
+    return {
+        'cnpj': cnpj,
+        'corporate_name': infos['nome'],
+        'trade_name': infos['fantasia'] or infos['nome'],
+        'status': infos['situacao'],
+    }
+
+
+async def lookup_external_company(cnpj):
+    # Returns (data, status) for the async endpoints below.
+    if not (isinstance(cnpj, str) and len(cnpj) == 14 and cnpj.isdigit()):
+        return {'cnpj': ['CNPJ deve conter 14 dígitos.']}, 400
+    try:
+        return await get_company_enrichment(cnpj), 200
+    except CNPJLookupError as e:
+        return {'error': str(e)}, 404
+    except CNPJRateLimitError as e:
+        return {'error': str(e)}, 429
+    except httpx.HTTPError:
+        return {'error': 'Serviço de consulta de CNPJ indisponível.'}, 502
+
+
+async def authorize_lookup(request):
+    # Lookups spend the shared receitaws quota, so they need a valid token and
+    # each user gets CNPJ_LOOKUP_USER_RATE_LIMIT of them per
+    # CNPJ_LOOKUP_USER_RATE_PERIOD. Returns the error response, if any.
+    try:
+        credentials = await sync_to_async(CachedTokenAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({'detail': str(e.detail)}, status=401)
+    if credentials is None:
+        return JsonResponse({'detail': 'As credenciais de autenticação não foram fornecidas.'}, status=401)
+    user, _ = credentials
+    limiter = RateLimiter(
+        f'cnpj_lookup:user:{user.pk}', settings.CNPJ_LOOKUP_USER_RATE_LIMIT, settings.CNPJ_LOOKUP_USER_RATE_PERIOD
+    )
+    wait = await sync_to_async(limiter.try_acquire)()
+    if wait:
+        response = JsonResponse({'error': str(RateLimitExceeded(wait))}, status=429)
+        response['Retry-After'] = str(math.ceil(wait))
+        return response
+    return None
+
+
+async def lookup_company(request, cnpj):
+    response = await authorize_lookup(request)
+    if response is not None:
+        return response
+    data, status = await lookup_external_company(cnpj)
+    return JsonResponse(data, status=status)
+
+
+create_company_view = CompanyViewSet.as_view({'post': 'create'})
+
+
+def wants_enrichment(request):
+    return request.method == 'POST' and (
+        request.GET.get('enrich', '').lower() in ('1', 'true') or settings.COMPANY_ENRICH_ON_CREATE
+    )
+
+
+async def enrich_company(request):
+    # With ?enrich=true (or COMPANY_ENRICH_ON_CREATE) the CNPJ is looked up
+    # before CompanyViewSet.create runs. Returns the error response, if any.
+    response = await authorize_lookup(request)
+    if response is not None:
+        return response
+    if request.content_type == 'application/json':
+        try:
+            cnpj = json.loads(request.body or b'{}').get('cnpj')
+        except (ValueError, AttributeError):
+            cnpj = None
     else:
-        data = {
-            'nome': response['nome'],
-            'fantasia': response['fantasia'],
-            'situacao': response['situacao']
-        }
-        return data
-    
\ No newline at end of file
+        cnpj = request.POST.get('cnpj')
+    data, status = await lookup_external_company(cnpj)
+    if status != 200:
+        return JsonResponse(data, status=status)
+    request.company_enrichment = data
+    return None
+
+
+async def create_company_async(request):
+    # Under ASGI the lookup runs on the event loop, so slow upstream calls
+    # hold no thread.
+    if wants_enrichment(request):
+        response = await enrich_company(request)
+        if response is not None:
+            return response
+    return await sync_to_async(create_company_view)(request)
+
+
+def create_company(request):
+    # Under WSGI plain creates go straight to CompanyViewSet.create; only
+    # enriched ones pay for an event loop.
+    if wants_enrichment(request):
+        response = async_to_sync(enrich_company)(request)
+        if response is not None:
+            return response
+    return create_company_view(request)
+
+
+create_company.csrf_exempt = True
+create_company_async.csrf_exempt = True
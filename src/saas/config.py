@@ -2,17 +2,36 @@ import os
 from django.core.management.utils import get_random_secret_key
 
 
+def get_env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes')
+
+
+def get_env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
 def get_postgres_configs():
     db_config = {
         "default": {
-            "ENGINE": "django.db.backends.postgresql",
+            "ENGINE": "saas.db",
             "NAME": os.environ.get('DB_HOST', 'postgres'),
             "USER": os.environ.get('DB_USER', 'postgres'),
             "PASSWORD": os.environ.get('DB_PASSWORD', 'developer123'),
             "HOST": os.environ.get('DB_HOST', 'localhost'),
             "PORT": os.environ.get('DB_PORT', '54321'),
+            "CONN_MAX_AGE": int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            "CONN_HEALTH_CHECKS": get_env_bool('DB_CONN_HEALTH_CHECKS', True),
         }
     }
+    if get_env_bool('DB_POOL', False):
+        # Pooled connections go back to the pool at the end of each request or
+        # task instead of staying attached to the thread.
+        db_config['default']['CONN_MAX_AGE'] = 0
+        db_config['default']['POOL'] = {
+            'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', '10')),
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+            'MAX_IDLE': float(os.environ.get('DB_POOL_MAX_IDLE', '300')),
+        }
     return db_config
 
 
@@ -27,3 +46,34 @@ def get_celery_config():
     host = os.environ.get('BROKER_HOST', 'localhost')
     port = os.environ.get('BROKER_PORT', '5672')
     return f'amqp://{user}:{password}@{host}:{port}'
+
+
+def get_cache_configs():
+    location = os.environ.get('CACHE_URL')
+    if not location:
+        return {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    return {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': location,
+        }
+    }
+
+
+PASSWORD_HASHER_CHOICES = {
+    'pbkdf2': 'restapi.hashers.TunedPBKDF2PasswordHasher',
+    'argon2': 'restapi.hashers.TunedArgon2PasswordHasher',
+}
+
+
+def get_password_hashers():
+    # PASSWORD_HASHER picks the hasher for new passwords; the others stay
+    # listed so existing hashes keep verifying and are upgraded on login.
+    preferred = PASSWORD_HASHER_CHOICES[os.environ.get('PASSWORD_HASHER', 'pbkdf2')]
+    return [
+        preferred,
+        *(hasher for hasher in PASSWORD_HASHER_CHOICES.values() if hasher != preferred),
+        'restapi.hashers.WrappedTransitionalPasswordHasher',
+        'restapi.hashers.TransitionalPasswordHasher',
+        'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    ]
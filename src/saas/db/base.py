@@ -0,0 +1,82 @@
+import os
+import threading
+
+from django.db.backends.postgresql import base
+
+from .pool import ConnectionPool
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict):
+    # Pools are keyed by process too, so a forked worker never reuses
+    # connections opened by its parent.
+    key = (alias, os.getpid())
+    with _pools_lock:
+        if key not in _pools:
+            options = settings_dict['POOL']
+            _pools[key] = ConnectionPool(
+                max_size=options.get('MAX_SIZE', 10),
+                timeout=options.get('TIMEOUT', 10),
+                max_idle=options.get('MAX_IDLE', 300),
+                health_checks=settings_dict.get('CONN_HEALTH_CHECKS', False),
+            )
+        return _pools[key]
+
+
+def pool_stats():
+    pid = os.getpid()
+    with _pools_lock:
+        pools = [(alias, pool) for (alias, owner), pool in _pools.items() if owner == pid]
+    return {alias: pool.stats() for alias, pool in pools}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # PostgreSQL backend with CONN_HEALTH_CHECKS (as in Django 4.1+) and an
+    # optional per-process connection pool, enabled by a POOL entry in the
+    # database settings.
+
+    health_check_done = False
+
+    @property
+    def pool(self):
+        if not self.settings_dict.get('POOL'):
+            return None
+        return get_pool(self.alias, self.settings_dict)
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        connection = pool.checkout(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        self.isolation_level = self.settings_dict['OPTIONS'].get('isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            pool.checkin(self.connection)
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (
+            self.connection is not None
+            and not self.health_check_done
+            and self.settings_dict.get('CONN_HEALTH_CHECKS')
+            and not self.in_atomic_block
+        ):
+            self.health_check_done = True
+            if not self.is_usable():
+                self.close()
+        super().ensure_connection()
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from psycopg2 import OperationalError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+
+class ConnectionPool:
+    # Per-process pool of raw psycopg2 connections. At most `max_size`
+    # connections are open at once; callers wait up to `timeout` seconds for a
+    # free one. Idle connections older than `max_idle` seconds are discarded.
+
+    def __init__(self, max_size, timeout, max_idle, health_checks=False):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.health_checks = health_checks
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.open_connections = 0
+        self.in_use = 0
+
+    def _is_healthy(self, connection):
+        if connection.closed:
+            return False
+        if not self.health_checks:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, connection):
+        with self._lock:
+            self.open_connections -= 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _pop_idle(self):
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                connection, returned_at = self._idle.pop()
+            if now - returned_at <= self.max_idle and self._is_healthy(connection):
+                return connection
+            self._discard(connection)
+
+    def checkout(self, connect):
+        started_at = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise OperationalError(f'No database connection available after {self.timeout}s')
+        waited = time.monotonic() - started_at
+        try:
+            connection = self._pop_idle()
+            if connection is None:
+                connection = connect()
+                with self._lock:
+                    self.open_connections += 1
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.checkouts += 1
+            self.wait_time += waited
+            self.in_use += 1
+        return connection
+
+    def checkin(self, connection):
+        with self._lock:
+            self.in_use -= 1
+        try:
+            if connection.closed:
+                with self._lock:
+                    self.open_connections -= 1
+                return
+            try:
+                if connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except Exception:
+                self._discard(connection)
+                return
+            with self._lock:
+                self._idle.append((connection, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds': self.wait_time,
+                'open_connections': self.open_connections,
+                'in_use': self.in_use,
+                'idle': len(self._idle),
+                'max_size': self.max_size,
+            }
@@ -1,6 +1,5 @@
 from pathlib import Path
-from celery.schedules import crontab
-from .config import get_django_secret, get_postgres_configs, get_celery_config
+from .config import get_env_bool, get_env_int, get_django_secret, get_password_hashers, get_postgres_configs, get_celery_config, get_cache_configs
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = get_django_secret()
@@ -9,12 +8,53 @@ CELERY_BROKER_URL = get_celery_config()
 CELERY_RESULT_BACKEND = 'django-db'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+COMPANIES_MAINTENANCE_BATCH_SIZE = 500
+# Every COMPANIES_MAINTENANCE_INTERVAL seconds the due companies are refreshed in
+# slices; a slice is sized to what CNPJ_API_RATE_LIMIT allows in that interval.
+COMPANIES_MAINTENANCE_INTERVAL = 5 * 60
+COMPANIES_MAINTENANCE_SLICE_SIZE = 15
+COMPANIES_MAINTENANCE_CHECKPOINT_SIZE = 5
+COMPANIES_MAINTENANCE_LEASE = 30 * 60
+COMPANIES_CHECK_JITTER = 3 * 24 * 60 * 60
+# Doubled for every consecutive failure of the same CNPJ, up to the max delay.
+COMPANIES_CHECK_RETRY_DELAY = 60 * 60
+COMPANIES_CHECK_RETRY_MAX_DELAY = 7 * 24 * 60 * 60
 CELERY_BEAT_SCHEDULE = {
-    'periodic_companies_maintenance': {
-        'task': 'restapi.tasks.periodic_companies_maintenance',
-        'schedule': crontab(0, 5),
+    'process_due_companies': {
+        'task': 'restapi.tasks.process_due_companies',
+        'schedule': COMPANIES_MAINTENANCE_INTERVAL,
     },
 }
+# Signup stores a PASSWORD_TRANSITIONAL_ITERATIONS hash and a celery task wraps
+# it with the preferred hasher, instead of hashing in the request. The sweep
+# catches signups whose task was lost.
+PASSWORD_SIGNUP_DEFERRED_HASHING = get_env_bool('PASSWORD_SIGNUP_DEFERRED_HASHING', False)
+PASSWORD_TRANSITIONAL_ITERATIONS = 1000
+if PASSWORD_SIGNUP_DEFERRED_HASHING:
+    CELERY_BEAT_SCHEDULE['upgrade_password_hashes'] = {
+        'task': 'restapi.tasks.upgrade_password_hashes',
+        'schedule': 10 * 60,
+    }
+# Set by saas/asgi.py: async views only get long-lived event loops under ASGI.
+ASGI = get_env_bool('DJANGO_ASGI', False)
+COMPANY_ENRICH_ON_CREATE = False
+COMPANIES_MAINTENANCE_FANOUT = False
+CNPJ_API_URL = 'https://receitaws.com.br/v1/'
+CNPJ_API_CONNECT_TIMEOUT = 5
+CNPJ_API_READ_TIMEOUT = 15
+CNPJ_API_RETRIES = 3
+CNPJ_API_BACKOFF_FACTOR = 1
+CNPJ_API_POOL_SIZE = 10
+CNPJ_API_CONCURRENCY = 10
+CNPJ_API_RATE_LIMIT = 3
+CNPJ_API_RATE_PERIOD = 60
+CNPJ_API_MAX_WAIT = 5
+# Per user share of the receitaws quota for /company/lookup/ and ?enrich=true.
+CNPJ_LOOKUP_USER_RATE_LIMIT = 2
+CNPJ_LOOKUP_USER_RATE_PERIOD = 60
+CNPJ_CACHE_TTL = 60 * 60 * 24
+CNPJ_CACHE_ERROR_TTL = 60 * 60
+CNPJ_CACHE_MAXSIZE = 1024
 
 DEBUG = False
 
@@ -34,6 +74,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'restapi.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -45,9 +86,29 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'restapi.authentication.CachedTokenAuthentication',
     ],
 }
+AUTH_TOKEN_CACHE_TTL = 60 * 5
+AUTH_TOKEN_CACHE_LOCAL_TTL = 5
+AUTH_TOKEN_CACHE_MAXSIZE = 10000
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+BULK_CREATE_BATCH_SIZE = 500
+COMPANY_CHANGES_PAGE_SIZE = 1000
+COMPANY_CHANGES_MAX_PAGE_SIZE = 10000
+# The changes feed only serves changes older than this many seconds; keep it
+# above twice the longest transaction that writes them.
+COMPANY_CHANGES_SAFETY_LAG = 60
+EXPORT_CHUNK_SIZE = 2000
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_TTL = 60 * 10
+RESPONSE_CACHE_MAXSIZE = 1024
+REQUEST_TIMING_ENABLED = get_env_bool('REQUEST_TIMING_ENABLED', False)
+REQUEST_TIMING_NPLUSONE_THRESHOLD = 5
+METRICS_PUBLISH_INTERVAL = 10
+METRICS_PROCESS_TTL = 60 * 5
+METRICS_MAX_PROCESSES = 64
 
 ROOT_URLCONF = 'saas.urls'
 
@@ -71,8 +132,21 @@ WSGI_APPLICATION = 'saas.wsgi.application'
 
 DATABASES = get_postgres_configs()
 
+CACHES = get_cache_configs()
+
 AUTH_USER_MODEL = 'restapi.User'
 
+PASSWORD_HASHERS = get_password_hashers()
+# Work factors of restapi.hashers. Changing them upgrades each hash on the
+# user's next login. Keep PASSWORD_ARGON2_PARALLELISM at the cores a login
+# may use: every gunicorn thread hashes on its own.
+PASSWORD_PBKDF2_ITERATIONS = get_env_int('PASSWORD_PBKDF2_ITERATIONS', 320000)
+PASSWORD_ARGON2_TIME_COST = get_env_int('PASSWORD_ARGON2_TIME_COST', 2)
+PASSWORD_ARGON2_MEMORY_COST = get_env_int('PASSWORD_ARGON2_MEMORY_COST', 102400)
+PASSWORD_ARGON2_PARALLELISM = get_env_int('PASSWORD_ARGON2_PARALLELISM', 1)
+# Threads per process that upgrade stale hashes after a login, 0 runs inline.
+PASSWORD_REHASH_WORKERS = 2
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',